@@ -0,0 +1,227 @@
+"""
+Benchmarks of the real Gallery/Album/Picture pipeline on synthetic photo trees.
+
+Every scenario runs in its own process so peak RSS is measured per scenario:
+
+    python -m benchmarks.run --depth 2 --photos-per-album 10 --output results.json
+    python -m benchmarks.run --compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+from .synthetic import (
+    TreeSpec,
+    add_spec_arguments,
+    last_photo,
+    make_photo,
+    make_tree,
+    spec_from_arguments,
+)
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent
+RSS_TEMPLATE = """<rss>{% for album in latest_sub_albums %}
+<item>{{ album.name }}</item>{% endfor %}
+</rss>
+"""
+
+SCENARIOS = ["cold", "warm", "single_change", "photo_cleanup"]
+
+
+def prepare_templates(work_dir: Path) -> Path:
+    template_dir = work_dir / "templates"
+    if not template_dir.exists():
+        shutil.copytree(PACKAGE_DIR / "burgher" / "templates", template_dir)
+        (template_dir / "rss.xml").write_text(RSS_TEMPLATE)
+    return template_dir
+
+
+def build(work_dir: Path, photo_dir: Path, workers: int, cleanup: bool):
+    """
+    One build in this process, returns its measurements
+    """
+    from burgher import Feed, Gallery, GalleryApp
+
+    template_dir = prepare_templates(work_dir)
+    index = work_dir / "index.md"
+    if not index.exists():
+        index.write_text("# Benchmark\n")
+
+    started = time.perf_counter()
+    app = GalleryApp(
+        name="benchmark",
+        template_dir=str(template_dir),
+        output_path=work_dir / "build",
+        context_db_path=work_dir / "context.sqlite",
+        check_paths=[template_dir],
+        workers=workers,
+    )
+    app.register(
+        gallery=Gallery(photo_dir, output_file="index.html", source_file=index),
+        rss=Feed(root_gallery=photo_dir, template_name="rss.xml"),
+    )
+    # peak of the grown tree before any rendering or thumbnails
+    grown_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    app.generate()
+    if cleanup:
+        # after generate, like a real build, so the manifest is used
+        app.photo_cleanup(dry=True)
+
+    measurements = {
+        "seconds": round(time.perf_counter() - started, 4),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "grown_rss_kb": grown_rss_kb,
+        "nodes": len(app.children_recursive()),
+    }
+    if cleanup:
+        measurements["cleanup_seconds"] = round(
+            app.profile.phases["cleanup"]["seconds"], 4
+        )
+    return measurements
+
+
+def snapshot(folder: Path) -> dict:
+    files = {}
+    for dirpath, _, filenames in os.walk(folder):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            files[path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    return files
+
+
+def run_scenario(work_dir: Path, photo_dir: Path, workers: int, scenario: str) -> dict:
+    before = snapshot(work_dir / "build")
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.run",
+            "--worker",
+            str(work_dir),
+            str(photo_dir),
+            str(workers),
+            "1" if scenario == "photo_cleanup" else "0",
+        ],
+        cwd=PACKAGE_DIR,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    measurements = json.loads(result.stdout.strip().splitlines()[-1])
+    after = snapshot(work_dir / "build")
+    measurements["files_written"] = sum(
+        1 for path, stat in after.items() if before.get(path) != stat
+    )
+    return measurements
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PACKAGE_DIR,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(spec: TreeSpec, data_dir: Path, workers: int, scenarios: list[str]) -> dict:
+    work_dir = data_dir / "runs" / spec.name()
+    if work_dir.exists():
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+    # the generated tree is kept between runs, single_change edits a linked copy of it
+    photo_dir = work_dir / "photos"
+    shutil.copytree(
+        make_tree(data_dir / "photos", spec), photo_dir, copy_function=os.link
+    )
+
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario not in scenarios:
+            continue
+        if scenario == "single_change":
+            photo = last_photo(photo_dir)
+            mtime = photo.stat().st_mtime
+            # a new file, the old one is a link to the generated tree
+            photo.unlink()
+            make_photo(photo, spec, random.Random(spec.seed + 1), 0)
+            # mtimes are compared in whole seconds and the tree may be new
+            mtime = max(time.time(), mtime + 1)
+            os.utime(photo, (mtime, mtime))
+        results[scenario] = run_scenario(work_dir, photo_dir, workers, scenario)
+        print(scenario, results[scenario], file=sys.stderr)
+
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "workers": workers,
+        "spec": asdict(spec),
+        "results": results,
+    }
+
+
+def compare(before_path, after_path):
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    print(f"{'scenario':<16}{'metric':<16}{before['commit']:>12}{after['commit']:>12}")
+    for scenario, measurements in after["results"].items():
+        old = before["results"].get(scenario, {})
+        for metric, value in measurements.items():
+            old_value = old.get(metric, "-")
+            ratio = ""
+            if isinstance(old_value, (int, float)) and old_value:
+                ratio = f"  x{value / old_value:.2f}"
+            print(f"{scenario:<16}{metric:<16}{old_value:>12}{value:>12}{ratio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_spec_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--data-dir", default="/tmp/burgher-benchmarks")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--worker", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        work_dir, photo_dir, workers, cleanup = args.worker
+        # progress bars and prints of the build go to stderr
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        measurements = build(
+            Path(work_dir), Path(photo_dir), int(workers), cleanup == "1"
+        )
+        print(json.dumps(measurements), file=stdout)
+        return
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    spec = spec_from_arguments(args)
+    report = run(spec, Path(args.data_dir), args.workers, args.scenarios.split(","))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Startup benchmark: how long a fresh process takes until burgher first looks at the photo
+tree (time-to-first-stat), and which heavy dependencies are imported by then.
+
+The build folder is generated once, then every run is a warm no-op build in a new process,
+which is what a cron job that finds nothing to do pays:
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+    python -m benchmarks.run --compare before.json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+# only the standard library is imported at module level, the worker measures the imports
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = [
+    "PIL",
+    "exifread",
+    "frontmatter",
+    "jinja2",
+    "markdown2",
+    "progress",
+    "slugify",
+    "yaml",
+]
+# audit events of the first directory listing of the photo tree
+LISTING_EVENTS = ("os.scandir", "os.listdir")
+
+
+def worker(work_dir: Path, photo_dir: Path):
+    """
+    One warm build, prints the absolute time of the first listing of photo_dir
+    """
+    first = {}
+    root = os.path.abspath(photo_dir)
+
+    def hook(event, args):
+        if first or event not in LISTING_EVENTS or not args or args[0] is None:
+            return
+        if os.path.abspath(os.fsdecode(args[0])).startswith(root):
+            first["time"] = time.time()
+            first["modules"] = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    sys.addaudithook(hook)
+
+    # progress bars and prints of the build go to stderr
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    import_started = time.perf_counter()
+    import burgher  # noqa: F401
+
+    import_seconds = time.perf_counter() - import_started
+
+    from .run import build
+
+    measurements = build(work_dir, photo_dir, workers=1, cleanup=False)
+    measurements.update(
+        {
+            "first_stat": first.get("time"),
+            "import_seconds": round(import_seconds, 4),
+            "heavy_modules_at_first_stat": len(first.get("modules", [])),
+            "heavy_modules": ",".join(first.get("modules", [])),
+        }
+    )
+    print(json.dumps(measurements), file=stdout)
+
+
+def run_once(work_dir: Path, photo_dir: Path) -> dict:
+    started = time.time()
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.startup",
+            "--worker",
+            str(work_dir),
+            str(photo_dir),
+        ],
+        cwd=PACKAGE_DIR,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+        text=True,
+    )
+    wall = time.time() - started
+    measurements = json.loads(result.stdout.strip().splitlines()[-1])
+    measurements["time_to_first_stat"] = round(
+        measurements.pop("first_stat") - started, 4
+    )
+    measurements["process_seconds"] = round(wall, 4)
+    return measurements
+
+
+def run(spec, data_dir: Path, runs: int) -> dict:
+    from .run import git_commit, run_scenario
+    from .synthetic import make_tree
+
+    photo_dir = make_tree(data_dir / "photos", spec)
+    work_dir = data_dir / "runs" / spec.name()
+    # the cold build is kept between invocations, only the warm runs are measured
+    if not (work_dir / "build").exists():
+        os.makedirs(work_dir, exist_ok=True)
+        run_scenario(work_dir, photo_dir, 1, "cold")
+
+    samples = [run_once(work_dir, photo_dir) for _ in range(runs)]
+    result = {}
+    for metric, value in samples[0].items():
+        if isinstance(value, (int, float)):
+            result[metric] = round(statistics.median(s[metric] for s in samples), 4)
+        else:
+            result[metric] = value
+    print("startup", result, file=sys.stderr)
+
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "spec": asdict(spec),
+        "results": {"startup": result},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--worker", nargs=2, help=argparse.SUPPRESS)
+    args, rest = parser.parse_known_args()
+    if args.worker:
+        worker(*map(Path, args.worker))
+        return
+
+    from .synthetic import add_spec_arguments, spec_from_arguments
+
+    add_spec_arguments(parser)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--data-dir", default="/tmp/burgher-benchmarks")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    spec = spec_from_arguments(args)
+    report = run(spec, Path(args.data_dir), args.runs)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
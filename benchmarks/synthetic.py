@@ -0,0 +1,109 @@
+"""
+Synthetic photo trees for the benchmarks.
+"""
+
+import argparse
+import os
+import random
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+
+@dataclass
+class TreeSpec:
+    depth: int = 2
+    albums_per_level: int = 3
+    photos_per_album: int = 5
+    width: int = 3000
+    height: int = 2000
+    exif: bool = True
+    embedded_every: int = 3  # every n-th album is an embedded _album, 0 disables
+    secret_every: int = 5  # every n-th album has a .secret file, 0 disables
+    seed: int = 1
+
+    def name(self) -> str:
+        return "-".join(f"{k}{v}" for k, v in asdict(self).items())
+
+
+def parse_bool(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser):
+    """
+    One --option per TreeSpec field
+    """
+    for field in fields(TreeSpec):
+        option = "--" + field.name.replace("_", "-")
+        if field.type is bool:
+            parser.add_argument(option, type=parse_bool, default=field.default)
+        else:
+            parser.add_argument(option, type=int, default=field.default)
+
+
+def spec_from_arguments(args: argparse.Namespace) -> TreeSpec:
+    return TreeSpec(**{f.name: getattr(args, f.name) for f in fields(TreeSpec)})
+
+
+def make_photo(path: Path, spec: TreeSpec, rng: random.Random, index: int):
+    # pillow is imported here so the startup benchmark does not load it for burgher
+    from PIL import Image
+
+    noise = Image.effect_noise((spec.width // 8, spec.height // 8), 64)
+    base = Image.new(
+        "RGB", (spec.width, spec.height), tuple(rng.randrange(256) for _ in range(3))
+    )
+    noise = noise.resize((spec.width, spec.height)).convert("RGB")
+    img = Image.blend(base, noise, 0.5)
+
+    exif = Image.Exif()
+    if spec.exif:
+        date = f"20{10 + index % 14:02d}:{1 + index % 12:02d}:{1 + index % 28:02d} 10:00:00"
+        exif[0x0132] = date  # DateTime
+        exif[0x0110] = "X-T5"  # Model
+        exif[0x0112] = 6 if index % 4 == 0 else 1  # Orientation
+    img.save(path, quality=85, exif=exif)
+
+
+def make_tree(root: Path, spec: TreeSpec) -> Path:
+    """
+    Creates the photo tree once, returns the photo dir
+    """
+    photo_dir = Path(root) / spec.name()
+    done_marker = photo_dir / ".complete"
+    if done_marker.exists():
+        return photo_dir
+
+    rng = random.Random(spec.seed)
+    counter = 0
+
+    def make_album(path: Path, level: int):
+        nonlocal counter
+        os.makedirs(path, exist_ok=True)
+        for i in range(spec.photos_per_album):
+            counter += 1
+            make_photo(path / f"IMG_{counter:06d}.jpg", spec, rng, counter)
+        (path / "info.md").write_text(f"# {path.name}\n\nSynthetic album.\n")
+
+        if level >= spec.depth:
+            return
+
+        for i in range(spec.albums_per_level):
+            counter += 1
+            name = f"Album {counter}"
+            if spec.embedded_every and counter % spec.embedded_every == 0:
+                name = "_" + name
+            sub_album = path / name
+            make_album(sub_album, level + 1)
+            if spec.secret_every and counter % spec.secret_every == 0:
+                (sub_album / ".secret").touch()
+
+    for i in range(spec.albums_per_level):
+        make_album(photo_dir / f"Top {i}", 1)
+
+    done_marker.touch()
+    return photo_dir
+
+
+def last_photo(photo_dir: Path) -> Path:
+    return sorted(photo_dir.rglob("*.jpg"))[-1]
@@ -1,13 +1,54 @@
-from .album import Album
-from .app import App, GalleryApp
-from .blog import BlogRoot
-from .gallery import Gallery
-from .node import Node
-from .static import StaticFolderNode, StaticNode
-from .feed import Feed
-from .template_nodes import (
-    FileTemplateNode,
-    FrontMatterNode,
-    MarkdownNode,
-    TemplateNode,
-)
+"""
+Nodes are imported on first access so that e.g. a cron job that finds nothing to do
+does not pay for importing jinja2, markdown2 or pillow.
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+# public name -> submodule it lives in
+EXPORTS = {
+    "Album": "album",
+    "App": "app",
+    "GalleryApp": "app",
+    "BlogRoot": "blog",
+    "Gallery": "gallery",
+    "Node": "node",
+    "StaticFolderNode": "static",
+    "StaticNode": "static",
+    "Feed": "feed",
+    "FileTemplateNode": "template_nodes",
+    "FrontMatterNode": "template_nodes",
+    "MarkdownNode": "template_nodes",
+    "TemplateNode": "template_nodes",
+}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+
+if TYPE_CHECKING:
+    from .album import Album
+    from .app import App, GalleryApp
+    from .blog import BlogRoot
+    from .gallery import Gallery
+    from .node import Node
+    from .static import StaticFolderNode, StaticNode
+    from .feed import Feed
+    from .template_nodes import (
+        FileTemplateNode,
+        FrontMatterNode,
+        MarkdownNode,
+        TemplateNode,
+    )
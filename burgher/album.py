@@ -1,12 +1,14 @@
 import email.utils
+import itertools
 import json
+import math
 import os
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
-import markdown2
-
 from .defaults import DEFAULT_DATE, THUMB_SIZES
+from .node import resolved
 from .picture import Picture
 from .template_nodes import TemplateNode
 from .utils import get_name, is_pic
@@ -16,10 +18,43 @@ class AlbumError(Exception):
     pass
 
 
+class AlbumPage(TemplateNode):
+    """
+    Second and following pages of a paginated album, rendered with the album template
+    """
+
+    template_node_name = "album"
+    indexable = False
+
+    def __init__(self, number, **kwargs):
+        super().__init__(**kwargs)
+        self.number = number
+        self.template_name = self.parent.template_name
+
+    def get_name(self):
+        return f"{self.parent.get_name()} {self.number}"
+
+    def get_output_name(self):
+        return f"page-{self.number}.html"
+
+    def skip_generation_paths(self):
+        return self.parent.skip_generation_paths()
+
+    def get_extra_context(self) -> dict:
+        c = super().get_extra_context()
+        c[self.template_node_name] = self.parent
+        c.update(self.parent.get_page_context(self.number))
+        return c
+
+    def get_target_context(self) -> dict:
+        c = super().get_target_context()
+        c.update(self.parent.get_page_links(self.number))
+        return c
+
+
 class Album(TemplateNode):
     name: str
     path: Path
-    description = None
     template_node_name = "album"
     show_progress = True
     indexable = True
@@ -32,12 +67,20 @@ class Album(TemplateNode):
         super().__init__(template_name="album.html", **kwargs)
         self.name = name
         self.path = path
-        self.description = description
+        # used when there is no info.md, see load_description
+        self.default_description = description
+        self.info_file = None
+        self.info_content = None
         self.thumb_sizes = thumb_sizes
         self.thumb_galleries = []
         self.pictures = {}
         self.sub_albums = {}
         self.embedded = {}
+        # frontmatter of info.md
+        self.metadata = {}
+
+        # derived values of the subtree, see invalidate_aggregates
+        self.aggregates = {}
 
         self.is_embedded = name.startswith("_")
         if self.is_embedded:
@@ -45,9 +88,47 @@ class Album(TemplateNode):
 
         self.is_secret = (Path(path) / ".secret").exists()
 
+    @resolved
     def get_output_folder(self):
         return super().get_output_folder() / self.get_output_name()
 
+    def load_description(self):
+        """
+        Reads the frontmatter of info.md, the markdown is rendered when the album is
+        """
+        info_file = Path(self.path) / "info.md"
+        if info_file.exists():
+            import frontmatter
+
+            info = frontmatter.load(info_file)
+            self.metadata = info.metadata
+            self.info_file = info_file
+            self.info_content = info.content
+        else:
+            self.metadata = {}
+            self.info_file = None
+            self.info_content = None
+
+    @property
+    def description(self):
+        if self.info_file is None:
+            return self.default_description
+        return self.render_markdown(self.info_file, self.info_content)
+
+    def markdown_paths(self):
+        return [self.info_file] if self.info_file else []
+
+    def grow_paths(self):
+        return [Path(self.path)]
+
+    def regrow(self):
+        self.pictures = {}
+        self.sub_albums = {}
+        self.embedded = {}
+        self.load_description()
+        super().regrow()
+
+    @resolved
     def get_output_path(self):
         return self.get_output_folder() / "index.html"
 
@@ -62,7 +143,24 @@ class Album(TemplateNode):
             return f"{self.parent.get_name()} / {self.get_name()}"
         return self.name
 
+    def invalidate_aggregates(self):
+        """
+        Forget memoized values of this album and all parent albums, call when the tree changes.
+        """
+        n = self
+        while isinstance(n, Album):
+            n.aggregates.clear()
+            n = n.parent
+
+    def memoize(self, name, func):
+        if name not in self.aggregates:
+            self.aggregates[name] = func()
+        return self.aggregates[name]
+
     def best_photo(self) -> Picture:
+        return self.memoize("best_photo", self.find_best_photo)
+
+    def find_best_photo(self) -> Picture:
         good_ratio = 16 / 9
         candidates = []
 
@@ -94,6 +192,9 @@ class Album(TemplateNode):
         return [Path(self.path)]
 
     def get_latest_date(self):
+        return self.memoize("latest_date", self.find_latest_date)
+
+    def find_latest_date(self):
         dates = [DEFAULT_DATE]
         dates.extend(filter(None, map(Picture.get_date, self.pictures.values())))
         dates.extend(filter(None, map(Album.get_latest_date, self.sub_albums.values())))
@@ -102,6 +203,9 @@ class Album(TemplateNode):
         return max(dates)
 
     def get_pictures_sorted(self):
+        return self.memoize("pictures_sorted", self.sort_pictures)
+
+    def sort_pictures(self):
         if not self.pictures:
             return []
 
@@ -111,9 +215,111 @@ class Album(TemplateNode):
         difference: timedelta = ascending[-1].get_date() - ascending[0].get_date()
 
         if difference.days > 10:
-            return reversed(ascending)
+            return list(reversed(ascending))
         return ascending
 
+    def get_page_size(self):
+        """
+        page_size from the info.md frontmatter or album_page_size from the config,
+        None renders all pictures on one page
+        """
+        page_size = self.metadata.get("page_size", self.get_config("album_page_size"))
+        if page_size is None:
+            return None
+
+        try:
+            number = int(page_size)
+        except (TypeError, ValueError):
+            number = 0
+        if number < 1:
+            raise ValueError(
+                f"Invalid page_size {page_size!r} of album {self.path}, "
+                "use a positive number"
+            )
+        return number
+
+    def get_page_count(self):
+        page_size = self.get_page_size()
+        if not page_size:
+            return 1
+        return max(1, math.ceil(len(self.pictures) / page_size))
+
+    def get_page_link(self, number):
+        if number == 1:
+            return self.get_link()
+        return self.children[f"page:{number}"].get_link()
+
+    def get_page_context(self, number) -> dict:
+        pictures = self.get_pictures_sorted()
+        page_size = self.get_page_size()
+        if page_size:
+            pictures = pictures[(number - 1) * page_size : number * page_size]
+
+        return {
+            "pictures": pictures,
+            "page": number,
+            "page_count": self.get_page_count(),
+        }
+
+    def get_page_links(self, number) -> dict:
+        """
+        Links to the other pages, see get_target_context
+        """
+        page_count = self.get_page_count()
+        return {
+            "page_links": [
+                (n, self.get_page_link(n)) for n in range(1, page_count + 1)
+            ],
+            "previous_page": self.get_page_link(number - 1) if number > 1 else None,
+            "next_page": (
+                self.get_page_link(number + 1) if number < page_count else None
+            ),
+            "json_link": (
+                self.get_link_to(self.get_json_path()) if self.has_json() else None
+            ),
+        }
+
+    def get_extra_context(self) -> dict:
+        c = super().get_extra_context()
+        c.update(self.get_page_context(1))
+        return c
+
+    def get_target_context(self) -> dict:
+        c = super().get_target_context()
+        c.update(self.get_page_links(1))
+        return c
+
+    def has_json(self):
+        """
+        Paginated albums always get the JSON sidecar, album_json=True adds it to all
+        """
+        return self.get_page_count() > 1 or bool(self.get_config("album_json"))
+
+    def get_json_path(self):
+        return self.get_output_folder() / "album.json"
+
+    def get_json(self):
+        return {
+            "name": self.name,
+            "link": self.get_link(),
+            "page_size": self.get_page_size(),
+            "pictures": [p.get_json() for p in self.get_pictures_sorted()],
+        }
+
+    def render(self, context=None):
+        super().render(context)
+
+        if self.has_json():
+            with self.app.profile.phase("render"):
+                data = json.dumps(self.get_json(), separators=(",", ":")).encode()
+                self.write_output(self.get_json_path(), data)
+
+    def get_output_files(self):
+        files = super().get_output_files()
+        if self.has_json():
+            files.append(self.get_json_path())
+        return files
+
     def get_sub_albums_sorted(self):
         if not self.sub_albums:
             return []
@@ -131,20 +337,21 @@ class Album(TemplateNode):
         )
 
     def grow(self):
+        self.invalidate_aggregates()
+        entries = list(os.scandir(self.path))
+
         # find all picture extensions
         self.pictures.update(
             {
                 get_name(p.name): Picture(path=Path(p.path), parent=self, app=self.app)
-                for p in os.scandir(self.path)
+                for p in entries
                 if is_pic(p.path)
             }
         )
 
-        for gal in [f for f in os.scandir(self.path) if f.is_dir()]:
+        for gal in [f for f in entries if f.is_dir()]:
             album = Album(name=gal.name, path=gal.path, parent=self, app=self.app)
-            info_file = Path(gal) / "info.md"
-            if info_file.exists():
-                album.description = markdown2.markdown_path(info_file)
+            album.load_description()
 
             if album.is_embedded:
                 self.embedded[gal.name] = album
@@ -154,12 +361,36 @@ class Album(TemplateNode):
         self.children.update(self.pictures)
         self.children.update(self.sub_albums)
         self.children.update(self.embedded)
-        super().grow()
+
+        for number in range(2, self.get_page_count() + 1):
+            self.children[f"page:{number}"] = AlbumPage(
+                number, parent=self, app=self.app
+            )
+
+        for picture in self.pictures.values():
+            picture.grow()
+        for album in itertools.chain(self.sub_albums.values(), self.embedded.values()):
+            self.app.submit_io(album.grow)
+
+    def after_grow(self):
+        super().after_grow()
+
+        # children are done already so this is a bottom up pass:
+        self.get_latest_date()
+        self.get_all_pictures()
 
     def generate(self):
+        started = time.perf_counter()
         super().generate()
+        self.app.profile.node_time(self, time.perf_counter() - started)
 
     def get_all_pictures(self):
+        return list(self.memoize("all_pictures", self.find_all_pictures))
+
+    def get_picture_count(self):
+        return self.memoize("picture_count", lambda: len(self.get_all_pictures()))
+
+    def find_all_pictures(self):
         pics = list(self.pictures.values())
         for c in self.sub_albums.values():
             pics.extend(c.get_all_pictures())
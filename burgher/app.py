@@ -1,15 +1,52 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from .context_db import ContextDB
+from .content_store import ContentStore
+from .context_db import ContextDB, open_context_db
+from .defaults import IO_THREADS, THUMB_FORMATS
 from .node import DEFAULT_CONFIG, Node
+from .picture import Picture
+from .profiling import BuildProfile
 from .utils import user_prompt
-from .hash_utils import recursive_max_stat
+from .hash_utils import DirectoryIndex, changed_directories
+from .inotify import open_inotify
+from .manifest import BuildManifest
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+# How many thumbnail jobs per worker can wait in the pool queue
+JOBS_PER_WORKER = 2
+
+# Config that changes the output of every page
+STATIC_CONFIG = (
+    "thumb_profiles",
+    "album_page_size",
+    "album_json",
+    "pictures_json",
+    "json_placeholders",
+)
 
 
 class App(Node):
     """
     The app works in two steps: first it collects root nodes and let them register - grow leafs
     and then it generates all leafs of the graph.
+
+    Growing runs in a pool of io_threads threads, with workers=N in the config the missing
+    thumbnails are generated in a pool of N processes before the graph is walked.
     """
 
     context_db: ContextDB
@@ -22,89 +59,408 @@ class App(Node):
         feed=None,
         local_build=None,
         check_paths=None,
+        context_db_backend="sqlite",
+        content_store_path=None,
         **config,
     ):
         super().__init__()
         self.feed = feed
 
         self.app_name = name
-        self.context_db = ContextDB(Path(context_db_path))
+        self.context_db = open_context_db(Path(context_db_path), context_db_backend)
 
-        self.static_hash = recursive_max_stat(check_paths)
+        # compiled templates are kept between runs next to the context db
+        self.template_cache_dir = Path(context_db_path).with_name(
+            Path(context_db_path).stem + "_templates"
+        )
+        self.template_environments = {}
+
+        self.content_store = None
+        if content_store_path:
+            self.content_store = ContentStore(content_store_path)
+
+        # shared by all nodes so every source tree is walked only once per build
+        self.directory_index = DirectoryIndex()
+        self.check_paths = check_paths or []
 
         default_config = DEFAULT_CONFIG.copy()
         default_config.update(config)
 
         self.config = default_config
+        self.local_build = local_build
+        self.static_hash = self.get_static_hash(self.directory_index)
         self.output_folder = Path(output_path).resolve()
 
-        self.local_build = local_build
+        self.deploy_output_folder = self.output_folder
+        self.deploy_domain = self.config.get("domain", "")
         self.app = self
 
+        self.io_pool = None
+        self.io_futures = deque()
+
+        self.profile = BuildProfile()
+        self.manifests = {}
+
     def get_output_folder(self):
         return self.output_folder
 
+    def get_static_hash(self, index: DirectoryIndex) -> str:
+        """
+        Digest of check_paths, STATIC_CONFIG and the build targets, a change in any of them
+        renders every page again
+        """
+        config = {key: self.config.get(key) for key in STATIC_CONFIG}
+        # skip checks are shared by the targets, a new local_build folder needs everything
+        config["local_build_folder"] = self.local_build and str(self.local_build)
+        h = hashlib.new("sha256")
+        h.update(json.dumps(config, sort_keys=True).encode())
+        h.update(index.recursive_digest(self.check_paths).encode())
+        return h.hexdigest()
+
+    def get_template_environment(self, template_dir) -> "Environment":
+        """
+        One jinja2 environment per template dir so that templates are compiled only once.
+        """
+        if template_dir not in self.template_environments:
+            from jinja2 import (
+                Environment,
+                FileSystemBytecodeCache,
+                FileSystemLoader,
+                select_autoescape,
+            )
+
+            os.makedirs(self.template_cache_dir, exist_ok=True)
+            self.template_environments[template_dir] = Environment(
+                loader=FileSystemLoader(template_dir),
+                autoescape=select_autoescape(["html", "xml"]),
+                bytecode_cache=FileSystemBytecodeCache(str(self.template_cache_dir)),
+            )
+        return self.template_environments[template_dir]
+
+    def submit_io(self, func, *args):
+        """
+        Runs I/O bound work of the grow phase in the thread pool, inline outside of register.
+        Tasks may submit more tasks but must not wait for them.
+        """
+        if self.io_pool is None:
+            func(*args)
+        else:
+            self.io_futures.append(self.io_pool.submit(func, *args))
+
+    def wait_io(self):
+        while self.io_futures:
+            self.io_futures.popleft().result()
+
     def register(self, **nodes):
         """
         The keyword arguments are used to as a namespace
         """
-        for name, node_pack in nodes.items():
-            if isinstance(node_pack, list):
-                for node in node_pack:
-                    node.parent = self
-                    node.app = self
-                    node.grow()
-                    self.children[f"{name}:{node.get_name()}"] = node
-            else:  # node pack is just one node
-                node_pack.parent = self
-                node_pack.app = self
-                node_pack.grow()
-                self.children[name] = node_pack
+        registered = []
+        io_threads = self.get_config("io_threads", IO_THREADS)
+        with self.profile.phase("grow"), ThreadPoolExecutor(io_threads) as pool:
+            self.io_pool = pool
+            try:
+                for name, node_pack in nodes.items():
+                    if isinstance(node_pack, list):
+                        for node in node_pack:
+                            node.parent = self
+                            node.app = self
+                            node.grow()
+                            self.children[f"{name}:{node.get_name()}"] = node
+                            registered.append(node)
+                    else:  # node pack is just one node
+                        node_pack.parent = self
+                        node_pack.app = self
+                        node_pack.grow()
+                        self.children[name] = node_pack
+                        registered.append(node_pack)
 
-    def generate(self):
+                self.wait_io()
+            finally:
+                self.io_pool = None
+
+            for node in registered:
+                node.after_grow()
+
+    def generate_thumbnails(self):
+        """
+        Generates all missing thumbnails in a process pool, new context is merged in this process.
+        """
+        workers = self.get_config("workers", 1)
+
+        jobs = []
+        for node in self.children_recursive():
+            if isinstance(node, Picture):
+                job = node.get_thumbnail_job()
+                if job:
+                    jobs.append((node, job))
+
+        if not jobs:
+            return
+
+        from progress.bar import Bar
+
+        from .thumbnails import generate_thumbnails
+
+        bar = Bar("Thumbnails", max=len(jobs))
+        in_flight = {}
+
+        def collect(futures):
+            for future in futures:
+                picture = in_flight.pop(future)
+                picture.finish_thumbnail_job(future.result())
+                bar.next()
+
+        phase = self.profile.phase("thumbnails")
+        with phase, ProcessPoolExecutor(max_workers=workers) as executor:
+            for picture, (path, thumbs) in jobs:
+                if len(in_flight) >= workers * JOBS_PER_WORKER:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                future = executor.submit(generate_thumbnails, path, thumbs)
+                in_flight[future] = picture
+
+            collect(list(in_flight))
+
+        bar.finish()
+
+    def generate_pass(self):
+        """
+        Generates every build target in one walk of the tree, see each_target
+        """
+        for _ in self.each_target():
+            self.start_manifest()
+        if self.get_config("workers", 1) > 1:
+            self.generate_thumbnails()
         super().generate()
+        for _ in self.each_target():
+            self.finish_manifest()
+
+    def get_manifest(self) -> BuildManifest:
+        if self.output_folder not in self.manifests:
+            self.start_manifest()
+        return self.manifests[self.output_folder]
+
+    def start_manifest(self):
+        self.manifests[self.output_folder] = BuildManifest(self.output_folder)
+
+    def finish_manifest(self):
+        """
+        Adds the outputs this build kept from previous builds and writes the manifest
+        """
+        manifest = self.get_manifest()
+        for node in self.children_recursive():
+            for path in node.get_output_files():
+                manifest.keep(path)
+        manifest.dump()
+
+    def generate(self):
+        self.generate_pass()
 
         if self.feed is not None:
-            self.process_feed(self.feed)
+            with self.profile.phase("feed"):
+                self.process_feed(self.feed)
 
-        if self.local_build:
+        with self.profile.phase("db_dump"):
+            self.context_db.dump()
+
+        print(
+            f"{self.profile.total('files_changed')} files changed, "
+            f"{self.profile.total('files_unchanged')} rendered unchanged"
+        )
+        self.write_profile()
+
+    def write_profile(self, summary=True):
+        """
+        Writes the JSON report to profile_path and prints the summary if profile_top is set
+        """
+        top = self.get_config("profile_top", 10)
+        path = self.get_config("profile_path")
+        if path:
+            self.profile.dump(path, top)
+        if summary and self.get_config("profile_top"):
+            self.profile.print_summary(top)
+
+    def set_target(self, local=False):
+        """
+        Switches between the deployed output and the local_build copy
+        """
+        if local:
             self.output_folder = Path(self.local_build).resolve()
             self.config["domain"] = ""
             self.config["local_build"] = True
-            super().generate()
+        else:
+            self.output_folder = self.deploy_output_folder
+            self.config["domain"] = self.deploy_domain
+            self.config["local_build"] = False
+        self.target = "local" if local else "deploy"
 
-        self.context_db.dump()
+    def each_target(self, targets=None):
+        """
+        Switches to each of the targets (get_targets by default) in turn and back to the
+        deployed one. Nodes write the outputs of all targets while generating, so the tree
+        is walked and the skip checks are done only once.
+        """
+        try:
+            for local in self.get_targets() if targets is None else targets:
+                self.set_target(local)
+                yield self.target
+        finally:
+            self.set_target(False)
 
+    def watched_paths(self) -> list[str]:
+        paths = {os.path.abspath(p) for p in self.check_paths}
+        for node in self.children_recursive():
+            for p in node.skip_generation_paths() + node.grow_paths():
+                paths.add(os.path.abspath(p))
+        return sorted(p for p in paths if os.path.exists(p))
 
-class GalleryApp(App):
-    def photo_cleanup(self, dry=True):
+    def watch(self, interval=1.0):
         """
-        Clean up files that are present from previous builds
+        Builds the site and keeps it up to date. Changes come from inotify where it is
+        available, only the changed directories are scanned again. Otherwise all sources
+        are polled every interval seconds. Only nodes affected by the change are grown and
+        generated again.
+
+        Template dir should be in check_paths, a change there renders everything again.
+        The feed list passed to the app is not refreshed.
         """
+        self.generate()
+
+        roots = self.watched_paths()
+        index = self.directory_index
+        index.recursive_digest(roots)
+        inotify = open_inotify(roots)
+        watched = set(roots)
+        print(f"Watching {len(roots)} paths for changes")
+
+        try:
+            while True:
+                if inotify is None:
+                    time.sleep(interval)
+                    new_index = DirectoryIndex()
+                else:
+                    changed = inotify.wait(interval)
+                    if changed is None:
+                        # the kernel dropped events, also those of new directories
+                        add_trees(inotify, roots)
+                        new_index = DirectoryIndex()
+                    elif changed:
+                        new_index = index.invalidate(changed)
+                    else:
+                        continue
+
+                if new_index.recursive_digest(roots) == index.recursive_digest(roots):
+                    continue
+
+                self.directory_index = new_index
+                try:
+                    self.apply_changes(index, new_index)
+                except Exception:
+                    traceback.print_exc()
 
-        # List of all images we generated:
-        files_generated = {
-            child.get_output_path() for child in self.children_recursive()
-        }
+                index = new_index
+                roots = self.watched_paths()
+                index.recursive_digest(roots)
+                if inotify is not None:
+                    add_trees(inotify, set(roots) - watched)
+                    watched.update(roots)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if inotify is not None:
+                inotify.close()
 
-        # Find all images
-        existing_imgs = set()
-        exts = ["*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG"]
-        for img_ext in exts:
-            existing_imgs.update(set(self.output_folder.rglob(img_ext)))
+    def apply_changes(self, old: DirectoryIndex, new: DirectoryIndex):
+        started = time.time()
 
+        static_hash = self.get_static_hash(new)
+        if static_hash != self.static_hash:
+            self.static_hash = static_hash
+            self.generate_pass()
+            self.context_db.dump()
+            print(f"Rebuilt everything in {time.time() - started:.2f}s")
+            return
+
+        changed = changed_directories(old, new)
+        regrow = [
+            n
+            for n in self.children_recursive()
+            if any(os.path.abspath(p) in changed for p in n.grow_paths())
+        ]
+        # nested nodes are grown again with their ancestor
+        regrow_set = set(regrow)
+        regrow = [n for n in regrow if not any(a in regrow_set for a in ancestors(n))]
+
+        regrown = set()
+        for node in regrow:
+            node.regrow()
+            regrown.add(node)
+            regrown.update(node.children_recursive())
+
+        updates = []
+        for node in self.children_recursive():
+            paths = node.skip_generation_paths()
+            if node in regrown or not paths:
+                continue
+            if old.recursive_digest(paths) != new.recursive_digest(paths):
+                updates.append(node)
+
+        for _ in self.each_target():
+            self.start_manifest()
+        for node in regrow:
+            node.generate()
+        for node in updates:
+            node.update()
+        for _ in self.each_target():
+            self.finish_manifest()
+
+        self.context_db.dump()
         print(
-            "Found",
-            len(existing_imgs),
-            "images",
-            "generated",
-            len(files_generated),
-            "files",
+            f"Grown {len(regrow)} and updated {len(updates)} nodes "
+            f"in {time.time() - started:.2f}s"
         )
 
-        to_delete = [
-            f for f in existing_imgs - files_generated if not "/static/" in str(f)
-        ]
+    def get_targets(self):
+        if self.local_build:
+            return [False, True]
+        return [False]
+
+
+def add_trees(inotify, paths):
+    """
+    Watches the trees of paths, directories watched already are fine
+    """
+    for path in paths:
+        try:
+            inotify.add_tree(path)
+        except OSError:
+            traceback.print_exc()
+
+
+def ancestors(node: Node):
+    n = node.parent
+    while n is not None:
+        yield n
+        n = n.parent
+
+
+class GalleryApp(App):
+    def photo_cleanup(self, dry=True):
+        """
+        Clean up files that are present from previous builds, in the output folder of
+        every build target.
+
+        Uses the manifest of the previous build if there is one, otherwise looks for images
+        in the output folder that are not generated. Without generate in this process the
+        files of the current tree are compared with the manifest on disk.
+        """
+        to_delete = []
+        for _ in self.each_target():
+            to_delete.extend(self.find_removed_files())
+        if self.content_store:
+            to_delete.extend(self.find_unused_store_files())
         to_delete_count = len(to_delete)
 
         needs_confirmation = to_delete_count > 10
@@ -124,3 +480,89 @@ class GalleryApp(App):
                 else:
                     print(f"Deleting", file_to_delete)
                     file_to_delete.unlink()
+            if self.content_store and not dry:
+                self.content_store.remove_empty_folders()
+
+        self.write_profile(summary=False)
+
+    def find_removed_files(self) -> list[Path]:
+        """
+        Files of previous builds in the output folder of the current target
+        """
+        manifest = self.manifests.get(self.output_folder)
+        if manifest is None:
+            manifest = BuildManifest(self.output_folder)
+            if manifest.previous is not None:
+                with self.profile.phase("cleanup"):
+                    for node in self.children_recursive():
+                        for path in node.get_output_files():
+                            manifest.keep(path)
+
+        if manifest.previous is None:
+            return self.find_unused_images()
+
+        # the previous build left a manifest, no need to look at the disk
+        with self.profile.phase("cleanup"):
+            removed = [f for f in manifest.removed() if f.exists()]
+        print(
+            f"Previous {self.target} build produced",
+            len(manifest.previous),
+            "files, this one",
+            len(manifest.files),
+        )
+
+        # a manifest edited by hand must not point outside of the output folder
+        outside = [
+            f
+            for f in removed
+            if not Path(os.path.normpath(f)).is_relative_to(self.output_folder)
+        ]
+        for f in outside:
+            print("Not deleting", f, "outside of", self.output_folder)
+        return [f for f in removed if f not in outside]
+
+    def find_unused_store_files(self) -> list[Path]:
+        """
+        Thumbnails in the content store that no picture of the tree links to
+        """
+        store = self.content_store
+        with self.profile.phase("cleanup"):
+            used = set()
+            for node in self.children_recursive():
+                if not isinstance(node, Picture):
+                    continue
+                content_hash = node.get_content_hash()
+                for thumb in node.get_thumbs():
+                    for path in thumb.get_output_files():
+                        name = thumb.get_store_name(path)
+                        used.add(store.get_path(content_hash, name))
+            unused = store.unused(used)
+        print("Content store has", len(unused), "unused files")
+        return unused
+
+    def find_unused_images(self):
+        with self.profile.phase("cleanup"):
+            # List of all images we generated:
+            files_generated = {
+                child.get_output_path() for child in self.children_recursive()
+            }
+            for child in self.children_recursive():
+                files_generated.update(child.get_output_files())
+
+            # Find all images
+            existing_imgs = set()
+            exts = ["*.jpg", "*.jpeg", "*.png", "*.JPG", "*.JPEG", "*.PNG"]
+            exts += [f"*{f.extension}" for f in THUMB_FORMATS.values()]
+            for img_ext in exts:
+                existing_imgs.update(set(self.output_folder.rglob(img_ext)))
+
+        print(
+            "Found",
+            len(existing_imgs),
+            "images",
+            "generated",
+            len(files_generated),
+            "files",
+        )
+
+        return [f for f in existing_imgs - files_generated if not "/static/" in str(f)]
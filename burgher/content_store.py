@@ -0,0 +1,48 @@
+import os
+from pathlib import Path
+
+from .utils import link_or_copy
+
+
+class ContentStore:
+    """
+    Generated files addressed by the content hash of their source picture.
+
+    Thumbnails survive renames and moves of the source: the new output path is linked
+    from the store instead of being encoded again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path).resolve()
+
+    def get_path(self, content_hash, name) -> Path:
+        return self.path / content_hash[:2] / content_hash / name
+
+    def restore(self, content_hash, name, output_path: Path) -> bool:
+        stored = self.get_path(content_hash, name)
+        if not stored.exists():
+            return False
+
+        os.makedirs(output_path.parent, exist_ok=True)
+        link_or_copy(stored, output_path)
+        return True
+
+    def add(self, content_hash, name, output_path: Path):
+        stored = self.get_path(content_hash, name)
+        if stored.exists() or not output_path.exists():
+            return
+
+        os.makedirs(stored.parent, exist_ok=True)
+        link_or_copy(output_path, stored)
+
+    def unused(self, used) -> list[Path]:
+        """
+        Stored files that are not in used, e.g. of deleted pictures or old profiles
+        """
+        used = set(used)
+        return [p for p in sorted(self.path.glob("*/*/*")) if p not in used]
+
+    def remove_empty_folders(self):
+        for folder in sorted(self.path.glob("*/*")) + sorted(self.path.glob("*")):
+            if folder.is_dir() and not any(folder.iterdir()):
+                folder.rmdir()
@@ -1,8 +1,17 @@
 import json
 import pathlib
+import sqlite3
+import threading
+
+# How many writes are buffered before they are flushed in one transaction
+SQLITE_BATCH_SIZE = 1000
 
 
 class ContextDB:
+    """
+    Keys can be read and written from multiple threads.
+    """
+
     def __init__(self, path: pathlib.Path):
         self.path = path
         self.data = {}
@@ -11,8 +20,27 @@ class ContextDB:
                 self.data = json.loads(f.read())
 
         self.keys_used = set()
+        self.lock = threading.RLock()
 
     def get_key(self, key, hash):
+        with self.lock:
+            return self.get_key_unlocked(key, hash)
+
+    def set_key(self, key, hash, data):
+        with self.lock:
+            self.set_key_unlocked(key, hash, data)
+
+    def mark_used(self, key):
+        """
+        Keeps the key from being purged without reading it
+        """
+        with self.lock:
+            self.mark_used_unlocked(key)
+
+    def mark_used_unlocked(self, key):
+        self.keys_used.add(key)
+
+    def get_key_unlocked(self, key, hash):
         self.keys_used.add(key)
 
         if not key or not hash:
@@ -30,7 +58,7 @@ class ContextDB:
         self.keys_used.add(key)
         return key_data["data"]
 
-    def set_key(self, key, hash, data):
+    def set_key_unlocked(self, key, hash, data):
         self.keys_used.add(key)
 
         self.data[key] = {"hash": hash, "data": data}
@@ -44,3 +72,126 @@ class ContextDB:
 
         with open(self.path, "w") as f:
             f.write(json.dumps(self.data, indent=2))
+
+
+class SqliteContextDB(ContextDB):
+    """
+    Same interface as ContextDB but keys are looked up one by one in sqlite instead of
+    loading the whole file. If given a .json path it uses .sqlite file next to it and
+    imports the old json data on the first run.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        json_path = None
+        if path.suffix == ".json":
+            json_path = path
+            path = path.with_suffix(".sqlite")
+
+        self.path = path
+        migrate = json_path is not None and json_path.exists() and not path.exists()
+
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS context "
+            "(key TEXT PRIMARY KEY, hash TEXT NOT NULL, data TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TEMP TABLE used (key TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+
+        self.pending = {}
+        self.keys_used = set()
+
+        if migrate:
+            self.import_json(json_path)
+
+    def import_json(self, json_path: pathlib.Path):
+        print(f"Migrating {json_path} to {self.path}")
+        old_db = ContextDB(json_path)
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO context (key, hash, data) VALUES (?, ?, ?)",
+                (
+                    (key, value["hash"], json.dumps(value["data"]))
+                    for key, value in old_db.data.items()
+                ),
+            )
+
+    def get_key_unlocked(self, key, hash):
+        self.mark_used_unlocked(key)
+
+        if not key or not hash:
+            return None
+
+        if key in self.pending:
+            hash_old, data = self.pending[key]
+        else:
+            row = self.connection.execute(
+                "SELECT hash, data FROM context WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            hash_old, data = row[0], json.loads(row[1])
+
+        # stale rows stay until they are overwritten by set_key or purged
+        if hash_old != hash:
+            return None
+
+        return data
+
+    def set_key_unlocked(self, key, hash, data):
+        self.mark_used_unlocked(key)
+
+        self.pending[key] = (hash, data)
+        if len(self.pending) >= SQLITE_BATCH_SIZE:
+            self.flush()
+
+    def mark_used_unlocked(self, key):
+        if not key:
+            return
+
+        self.keys_used.add(key)
+        if len(self.keys_used) >= SQLITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes buffered keys and used marks in one transaction
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO context (key, hash, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET hash = excluded.hash, data = excluded.data",
+                (
+                    (key, hash, json.dumps(data))
+                    for key, (hash, data) in self.pending.items()
+                ),
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO used (key) VALUES (?)",
+                ((key,) for key in self.keys_used),
+            )
+        self.pending.clear()
+        self.keys_used.clear()
+
+    def dump(self):
+        with self.lock:
+            self.flush()
+
+        with self.connection:
+            purged = self.connection.execute(
+                "DELETE FROM context WHERE key NOT IN (SELECT key FROM used)"
+            ).rowcount
+        if purged:
+            print(f"Purging {purged} unused keys")
+
+
+def open_context_db(path: pathlib.Path, backend="sqlite") -> ContextDB:
+    if backend == "json":
+        return ContextDB(path)
+    if backend == "sqlite":
+        return SqliteContextDB(path)
+    raise ValueError(f"Unknown context db backend {backend}")
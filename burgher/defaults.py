@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import NamedTuple
 
 PICTURE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
 EXIF_INTERESTING_TAGS = {
@@ -14,3 +15,23 @@ EXIF_INTERESTING_TAGS = {
 }
 DEFAULT_DATE = datetime(1970, 1, 1)
 THUMB_SIZES = ("1920x1920", "3000x3000", "4000x3000")
+
+# Metadata of pictures is parsed from this many bytes at the start of the file
+METADATA_HEADER_SIZE = 256 * 1024
+
+# Threads for scanning directories and reading picture metadata while the tree grows
+IO_THREADS = 8
+
+
+class ThumbFormat(NamedTuple):
+    pillow_name: str
+    extension: str
+    mime: str
+
+
+# Formats thumbnails can be saved in next to the format of the source, kept here so
+# output paths are known without importing pillow
+THUMB_FORMATS = {
+    "avif": ThumbFormat("AVIF", ".avif", "image/avif"),
+    "webp": ThumbFormat("WEBP", ".webp", "image/webp"),
+}
@@ -1,13 +1,16 @@
+import itertools
 import json
 import os
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime
 from pathlib import Path
 
-import markdown2
-
 from .album import Album
 from .template_nodes import MarkdownNode
+from .utils import StreamIfChanged
+
+# How pictures.json can be sharded, see Gallery.generate_json
+JSON_SHARDS = ("year", "album")
 
 
 class Gallery(MarkdownNode):
@@ -27,6 +30,8 @@ class Gallery(MarkdownNode):
         super().__init__(template_name=template_name, **kwargs)
         self.output_file = output_file
         self.photo_dir = Path(photo_dir).resolve()
+        # (digest of the photo tree, shards), see get_json_shards
+        self.json_shards = None
 
     def get_output_name(self):
         return self.output_file
@@ -69,45 +74,130 @@ class Gallery(MarkdownNode):
     def grow(self):
         for gal in [f for f in os.scandir(self.photo_dir) if f.is_dir()]:
             album = Album(name=gal.name, path=gal.path, parent=self, app=self.app)
-            info_file = Path(gal) / "info.md"
-            if info_file.exists():
-                album.description = markdown2.markdown_path(info_file)
+            album.load_description()
 
             self.children[gal.name] = album
-        super().grow()
+            self.app.submit_io(album.grow)
 
     def skip_generation_paths(self):
         return [self.source_file, self.photo_dir]
 
-    def generate(self):
-        super().generate()
-        # self.generate_json()
-
-
+    def grow_paths(self):
+        return [self.photo_dir]
+
+    def render(self, context=None):
+        super().render(context)
+
+        if self.get_config("pictures_json"):
+            with self.app.profile.phase("pictures_json"):
+                self.generate_json()
+
+    def get_output_files(self):
+        files = super().get_output_files()
+        if self.get_config("pictures_json"):
+            files.append(self.get_json_path())
+            files.extend(self.get_shard_path(name) for name in self.get_json_shards())
+        return files
+
+    def get_json_path(self):
+        return self.get_output_folder() / "pictures.json"
+
+    def get_shard_path(self, name):
+        # album output folders never start with an underscore
+        return self.get_output_folder() / "_pictures" / f"{name}.json"
+
+    def public_albums(self) -> list[Album]:
+        """
+        All albums except the secret ones and albums inside them
+        """
+        albums = [a for a in self.children.values() if not a.is_secret]
+        for album in albums:
+            children = itertools.chain(album.sub_albums.values(), album.embedded.values())
+            albums.extend(a for a in children if not a.is_secret)
+        return albums
+
+    def get_json_shards(self) -> dict:
+        """
+        Shard name -> pictures, sharded by "year" or "album" as set by pictures_json config.
+        Computed again only when something in the photo tree changed.
+        """
+        digest = self.app.directory_index.recursive_digest([self.photo_dir])
+        if self.json_shards is None or self.json_shards[0] != digest:
+            self.json_shards = (digest, self.collect_json_shards())
+        return self.json_shards[1]
+
+    def collect_json_shards(self) -> dict:
+        shard_by = self.get_config("pictures_json")
+        if shard_by not in JSON_SHARDS:
+            raise ValueError(f"pictures_json must be one of {JSON_SHARDS}")
+
+        shards = defaultdict(list)
+        for album in self.public_albums():
+            for picture in album.pictures.values():
+                if shard_by == "album":
+                    folder = album.get_output_folder()
+                    name = str(folder.relative_to(self.get_output_folder()))
+                else:
+                    name = str(picture.get_date().year)
+                shards[name].append(picture)
+        return shards
 
     def generate_json(self):
-        all_pics = []
-        models = set()
-        lens = set()
-
-        for album in self.children.values():
-            if album.is_secret:
-                continue
-
-            for pic in album.get_all_pictures():
-                pic_data = pic.get_json()
-                all_pics.append(pic_data)
-                models.add(pic_data.get("model", ""))
-                lens.add(pic_data.get("lens", ""))
-
-        models.remove(None)
-        lens.remove(None)
-
-        data = {
-            "pics": all_pics,
-            "models": sorted(list(models)),
-            "lens": sorted(list(lens)),
+        """
+        Streams pictures into one JSON list per shard and writes pictures.json index of the
+        shards with camera and lens facets, so clients only load the shards they need.
+        """
+        models = Counter()
+        lenses = Counter()
+        shards = []
+
+        manifest = self.app.get_manifest()
+        for name, pictures in sorted(self.get_json_shards().items()):
+            path = self.get_shard_path(name)
+            os.makedirs(path.parent, exist_ok=True)
+
+            shard_models = Counter()
+            shard_lenses = Counter()
+            pictures.sort(key=lambda p: (p.get_date(), str(p.path)))
+            with StreamIfChanged(path) as f:
+                f.write(b"[")
+                for i, picture in enumerate(pictures):
+                    data = picture.get_json()
+                    data["album"] = picture.parent.get_link()
+                    if data.get("model"):
+                        shard_models[data["model"]] += 1
+                    if data.get("lens"):
+                        shard_lenses[data["lens"]] += 1
+
+                    f.write(b"," if i else b"")
+                    f.write(json.dumps(data, separators=(",", ":")).encode())
+                f.write(b"]")
+
+            manifest.record_digest(path, f.size, f.digest)
+            if f.changed:
+                self.app.profile.count(self, "files_changed")
+                self.app.profile.count(self, "bytes_written", f.size)
+            else:
+                self.app.profile.count(self, "files_unchanged")
+
+            models.update(shard_models)
+            lenses.update(shard_lenses)
+            shards.append(
+                {
+                    "name": name,
+                    "link": self.get_link_to(path),
+                    "count": len(pictures),
+                    "models": sorted(shard_models),
+                    "lenses": sorted(shard_lenses),
+                }
+            )
+
+        index = {
+            "shard_by": self.get_config("pictures_json"),
+            "shards": shards,
+            "models": dict(sorted(models.items())),
+            "lenses": dict(sorted(lenses.items())),
         }
-
-        with open(self.get_output_folder() / "pictures.json", "w") as f:
-            f.write(json.dumps(data, indent=4))
+        self.write_output(
+            self.get_json_path(), json.dumps(index, separators=(",", ":")).encode()
+        )
@@ -2,6 +2,9 @@ import hashlib
 import os
 from pathlib import Path
 
+# sampled_digest reads this much from start, middle and end of the file
+SAMPLE_SIZE = 64 * 1024
+
 IGNORE_FILES = [
     "__pycache__",
     ".git",
@@ -17,27 +20,115 @@ def ignore_path(path: Path):
     return False
 
 
-def recursive_max_stat(paths: list[Path], initial_hash=""):
-    if not paths:
-        return ""
-
-    files = []
-    prev_hash = initial_hash
+def sampled_digest(path) -> str:
+    """
+    Fast content hash: file size plus a sha256 of three samples, small files are read whole.
+    """
+    size = os.stat(path).st_size
+    h = hashlib.new("sha256")
+    h.update(str(size).encode())
 
-    for p in paths:
-        if p.is_dir():
-            files.extend(list(p.rglob("**/*")))
+    with open(path, "rb") as f:
+        if size <= 3 * SAMPLE_SIZE:
+            h.update(f.read())
         else:
-            files.append(p)
+            for offset in (0, size // 2, size - SAMPLE_SIZE):
+                f.seek(offset)
+                h.update(f.read(SAMPLE_SIZE))
+
+    return f"{size}-{h.hexdigest()}"
+
+
+class DirectoryIndex:
+    """
+    Digests of files and directories collected with a single scandir pass per tree.
 
-    for path in sorted(files):
-        if ignore_path(path):
-            continue
+    Directory digest is made from names and digests of everything inside it, Merkle style,
+    so once a tree was scanned any of its subdirectories can be looked up without walking
+    it again.
 
-        stat = os.stat(path)
-        keys = str(int(stat.st_mtime)) + prev_hash
+    Shallow digests only cover the directory listing and the files directly inside, they tell
+    which directories changed themselves rather than somewhere below them.
+    """
+
+    def __init__(self):
+        self.digests = {}
+        self.shallow_digests = {}
+
+    def digest(self, path) -> str:
+        key = os.path.abspath(path)
+        if key not in self.digests:
+            if os.path.isdir(key):
+                self.scan(key)
+            else:
+                self.digests[key] = self.file_digest(key)
+        return self.digests[key]
+
+    @staticmethod
+    def file_digest(path) -> str:
+        return str(int(os.stat(path).st_mtime))
+
+    def scan(self, path) -> str:
         h = hashlib.new("sha256")
-        h.update(keys.encode())
-        prev_hash = h.hexdigest()
+        shallow = hashlib.new("sha256")
+
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+
+        for entry in entries:
+            if ignore_path(entry.path):
+                continue
+
+            if entry.is_dir():
+                digest = self.digests.get(entry.path) or self.scan(entry.path)
+                shallow.update(f"{entry.name}/\n".encode())
+            else:
+                digest = str(int(entry.stat().st_mtime))
+                shallow.update(f"{entry.name}:{digest}\n".encode())
+            h.update(f"{entry.name}:{digest}\n".encode())
+
+        self.shallow_digests[path] = shallow.hexdigest()
+        self.digests[path] = h.hexdigest()
+        return self.digests[path]
+
+    def invalidate(self, paths) -> "DirectoryIndex":
+        """
+        Copy of the index that scans the paths and their parent directories again,
+        everything else is taken over without touching the disk.
+        """
+        stale = set()
+        for path in paths:
+            path = os.path.abspath(path)
+            while path not in stale:
+                stale.add(path)
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+        index = DirectoryIndex()
+        index.digests = {k: v for k, v in self.digests.items() if k not in stale}
+        index.shallow_digests = {
+            k: v for k, v in self.shallow_digests.items() if k not in stale
+        }
+        return index
+
+    def recursive_digest(self, paths: list[Path], initial_hash=""):
+        if not paths:
+            return ""
+
+        h = hashlib.new("sha256")
+        h.update(initial_hash.encode())
+        for path in paths:
+            h.update(self.digest(path).encode())
+        return h.hexdigest()
+
 
-    return prev_hash
+def changed_directories(old: DirectoryIndex, new: DirectoryIndex) -> set[str]:
+    """
+    Directories whose listing or direct files differ between two indexes
+    """
+    paths = old.shallow_digests.keys() | new.shallow_digests.keys()
+    return {
+        p for p in paths if old.shallow_digests.get(p) != new.shallow_digests.get(p)
+    }
@@ -0,0 +1,163 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import Optional
+
+from .hash_utils import ignore_path
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+# struct inotify_event without the name that follows it
+EVENT_HEADER = struct.Struct("iIII")
+
+# events keep coming while e.g. an album is copied, they are handled once it is quiet
+# for this many seconds
+SETTLE_SECONDS = 0.2
+
+
+class Inotify:
+    """
+    Paths that changed below watched directories, Linux only.
+
+    Directories are watched one by one, directories created later are added as their
+    events arrive. Watched files are covered by a watch on their directory so editors
+    that replace the file on save are noticed too.
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise self.error()
+        # watch descriptor -> directory
+        self.watches = {}
+
+    def error(self, path=None) -> OSError:
+        errno = ctypes.get_errno()
+        return OSError(errno, os.strerror(errno), path)
+
+    def add(self, path):
+        # the kernel returns the same descriptor for a directory watched already
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise self.error(path)
+        self.watches[wd] = os.path.abspath(path)
+
+    def add_tree(self, path):
+        if not os.path.isdir(path):
+            self.add(os.path.dirname(os.path.abspath(path)))
+            return
+
+        for dirpath, dirnames, _ in os.walk(path, followlinks=True):
+            dirnames[:] = [d for d in dirnames if not ignore_path(d)]
+            self.add(dirpath)
+
+    def read(self, timeout) -> Optional[set[str]]:
+        """
+        Paths changed within timeout seconds, None when the kernel dropped events
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                changed.add(path)
+
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        # gone again already, its parent changed anyway
+                        pass
+
+    def wait(self, timeout, settle=SETTLE_SECONDS) -> Optional[set[str]]:
+        """
+        Like read but once something changed, waits until there are no events for
+        settle seconds so one burst of changes is handled at once.
+        """
+        changed = self.read(timeout)
+        while changed:
+            more = self.read(settle)
+            if more is None:
+                return None
+            if not more:
+                break
+            changed |= more
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_inotify(paths) -> Optional[Inotify]:
+    """
+    Inotify watching the paths or None if it is not available, e.g. on other systems
+    or when the watch limit is too low for the tree
+    """
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError, TypeError) as e:
+        print(f"inotify is not available ({e}), polling for changes")
+        return None
+
+    try:
+        for path in paths:
+            inotify.add_tree(path)
+    except OSError as e:
+        print(f"Can't watch {e.filename} ({e.strerror}), polling for changes")
+        inotify.close()
+        return None
+    return inotify
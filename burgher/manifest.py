@@ -0,0 +1,93 @@
+import hashlib
+import json
+from pathlib import Path
+
+from .utils import write_if_changed
+
+MANIFEST_NAME = ".burgher-manifest.json"
+
+
+def file_digest(path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()[:32]
+
+
+class BuildManifest:
+    """
+    Every file one build produced in the output folder: relative path -> [size, digest].
+
+    Files written by this build are recorded with their content, files the build kept from
+    the previous one take their entry from the previous manifest, so nothing is re-read.
+
+    Files a build stopped producing stay listed as pending removal until they are deleted,
+    so builds without a photo_cleanup in between do not lose track of them.
+    """
+
+    def __init__(self, output_folder):
+        self.output_folder = Path(output_folder)
+        self.path = self.output_folder / MANIFEST_NAME
+        self.files = {}
+
+        self.previous = None
+        self.previous_pending = []
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                data = json.loads(f.read())
+            if "files" in data and "pending_removal" in data:
+                self.previous = data["files"]
+                self.previous_pending = data["pending_removal"]
+            else:
+                # manifest of older versions, only the files
+                self.previous = data
+
+    def relative(self, path) -> str:
+        return str(Path(path).relative_to(self.output_folder))
+
+    def record(self, path, content: bytes = None):
+        """
+        Adds a file written by this build
+        """
+        if content is None:
+            self.record_digest(path, Path(path).stat().st_size, file_digest(path))
+        else:
+            self.record_digest(path, len(content), hashlib.sha256(content).hexdigest())
+
+    def record_digest(self, path, size, digest: str):
+        """
+        Adds a file written by this build whose sha256 hex digest is known already
+        """
+        self.files[self.relative(path)] = [size, digest[:32]]
+
+    def keep(self, path):
+        """
+        Adds a file this build produces but did not write
+        """
+        key = self.relative(path)
+        if key in self.files:
+            return
+
+        if self.previous and key in self.previous:
+            self.files[key] = self.previous[key]
+        elif Path(path).exists():
+            self.record(path)
+
+    def removed(self) -> list[Path]:
+        """
+        Files of previous builds this build did not produce
+        """
+        if self.previous is None:
+            return []
+        paths = set(self.previous) | set(self.previous_pending)
+        return [self.output_folder / p for p in sorted(paths) if p not in self.files]
+
+    def dump(self):
+        """
+        Writes the manifest unless it is unchanged, removed files that still exist are
+        carried over as pending removal
+        """
+        pending = [self.relative(p) for p in self.removed() if p.exists()]
+        data = {"files": self.files, "pending_removal": pending}
+        self.output_folder.mkdir(parents=True, exist_ok=True)
+        write_if_changed(
+            self.path, json.dumps(data, separators=(",", ":"), sort_keys=True).encode()
+        )
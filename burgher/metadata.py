@@ -0,0 +1,46 @@
+import io
+import struct
+
+import exifread
+from PIL import Image as PILImage
+
+from .defaults import METADATA_HEADER_SIZE
+
+# what exifread and Pillow raise on a file that is cut short
+PARSE_ERRORS = (OSError, ValueError, EOFError, struct.error, KeyError, IndexError)
+
+
+def parse_metadata(f):
+    """
+    Returns exif tags and (width, height) as stored in the file, ignoring orientation.
+    """
+    tags = exifread.process_file(f, details=False)
+    f.seek(0)
+    with PILImage.open(f) as im:
+        size = im.size
+    return tags, size
+
+
+def read_metadata(path, header_size=METADATA_HEADER_SIZE):
+    """
+    Reads exif tags and pixel size with one open and usually one read.
+
+    Both exif and image dimensions live at the start of the file so they are parsed from
+    the first header_size bytes. Only if that is not enough, the header can't be parsed or
+    it has no exif or size, the whole file is used.
+    """
+    with open(path, "rb") as f:
+        header = f.read(header_size)
+        if len(header) < header_size:
+            # that is the whole file
+            return parse_metadata(io.BytesIO(header))
+
+        try:
+            tags, size = parse_metadata(io.BytesIO(header))
+            if tags and size:
+                return tags, size
+        except PARSE_ERRORS:
+            pass
+
+        f.seek(0)
+        return parse_metadata(f)
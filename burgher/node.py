@@ -1,16 +1,42 @@
+import functools
 import os
+from types import MappingProxyType
 from typing import Optional
 from urllib.parse import quote
 
-from progress.bar import Bar
-from slugify import slugify
+DEFAULT_CONFIG = {"template_dir": "templates"}
 
-from .hash_utils import recursive_max_stat
+# get_config result of a key no node in the chain has
+MISSING = object()
 
-DEFAULT_CONFIG = {"template_dir": "templates"}
+
+@functools.cache
+def get_slugify():
+    """
+    python-slugify is imported on first use, not with burgher, and only once
+    """
+    from slugify import slugify
+
+    return slugify
+
+
+def resolved(method):
+    """
+    Memoizes a method without arguments per build target, see Node.get_resolved
+    """
+    key = method.__qualname__
+
+    @functools.wraps(method)
+    def wrapper(self):
+        return self.get_resolved(key, lambda: method(self))
+
+    return wrapper
 
 
 class Node:
+    # subclasses get a __dict__ unless they define __slots__ too, see LeafNode
+    __slots__ = ()
+
     parent: "Node" = None
     children = None
     show_progress = False
@@ -18,6 +44,9 @@ class Node:
     rewrite_html_links = True  # /page.html -> /page
     app: "app"
 
+    # build target of the root node, see App.set_target
+    target = "deploy"
+
     def __init__(self, parent=None, app=None, **config):
         self.children = {}
         self.parent = parent
@@ -25,17 +54,42 @@ class Node:
         self.cache_data = False
         self.app = app
 
+        self.resolved = {}
+        self.resolved_root = None
+
     def __str__(self):
         return self.get_name()
 
+    def get_resolved(self, key, func):
+        """
+        Value of func for the current root and build target, computed once. Links, paths
+        and config are resolved through the parent chain so they are memoized with this.
+        """
+        root = self.get_root_node()
+        if self.resolved_root is not root:
+            self.resolved = {}
+            self.resolved_root = root
+
+        key = (root.target, key)
+        if key not in self.resolved:
+            self.resolved[key] = func()
+        return self.resolved[key]
+
     def get_config(self, key, default=None):
+        value = self.get_resolved(("config", key), lambda: self.find_config(key))
+        if value is MISSING:
+            return default
+        return value
+
+    def find_config(self, key):
         if key in self.config:
             return self.config[key]
 
         if self.parent:
-            return self.parent.get_config(key, default)
-        return default
+            return self.parent.get_config(key, MISSING)
+        return MISSING
 
+    @resolved
     def get_base_link_url(self):
         if self.get_config("local_build"):
             return ""
@@ -45,11 +99,18 @@ class Node:
             return f"/{base_path}/"
         return "/"
 
+    @resolved
     def get_link(self):
+        return self.get_link_to(self.get_output_path())
+
+    def get_link_to(self, path):
+        """
+        Link to a file this node writes into the output folder
+        """
         if self.get_config("local_build"):
-            return str(self.get_output_path())
+            return str(path)
 
-        relative_dir = self.get_output_path().relative_to(self.get_absolute_output())
+        relative_dir = path.relative_to(self.get_absolute_output())
         if relative_dir.name == "index.html":
             relative_dir = relative_dir.parent
 
@@ -62,18 +123,26 @@ class Node:
     def get_absolute_link(self):
         return self.get_config("domain", "") + self.get_link()
 
+    @resolved
     def get_output_folder(self):
         return self.parent.get_output_folder()
 
+    @resolved
     def get_output_path(self):
         return self.get_output_folder() / self.get_output_name()
 
     def get_output_name(self):
-        return slugify(self.get_name())
+        return get_slugify()(self.get_name())
 
     def get_name(self):
         raise NotImplementedError
 
+    def get_output_files(self) -> list:
+        """
+        Files this node produces in the output folder, see BuildManifest
+        """
+        return []
+
     def skip_generation_paths(self):
         return []
 
@@ -88,27 +157,50 @@ class Node:
         app = self.get_root_node()
         key = str(self.get_output_path())
 
-        most_mtime = recursive_max_stat(paths, app.static_hash)
-        unchanged = app.context_db.get_key(key, str(most_mtime))
+        with app.profile.phase("skip_checks"):
+            most_mtime = app.directory_index.recursive_digest(paths, app.static_hash)
+            unchanged = self.get_cached(key, str(most_mtime))
+            # e.g. the local_build folder was deleted
+            unchanged = unchanged and all(self.exists() for _ in app.each_target())
         if unchanged:
             self.show_progress = False
             return True
 
         app.context_db.set_key(key, str(most_mtime), True)
 
+    def get_cached(self, key, hash):
+        """
+        ContextDB lookup counted as a cache hit or miss of this node class
+        """
+        app = self.get_root_node()
+        data = app.context_db.get_key(key, hash)
+        app.profile.count(self, "cache_hits" if data else "cache_misses")
+        return data
+
     def generate(self):
         """
         Method that generates the file into the output directory
         """
-        os.makedirs(self.get_output_folder().absolute(), exist_ok=True)
+        for _ in self.get_root_node().each_target():
+            os.makedirs(self.get_output_folder().absolute(), exist_ok=True)
+
+        # with workers the slow part has its own progress bar already
+        if self.show_progress and self.get_config("workers", 1) <= 1:
+            from progress.bar import Bar
 
-        if self.show_progress:
             for child in Bar(self.get_name()).iter(self.children.values()):
                 child.generate()
         else:
             for c in self.children.values():
                 c.generate()
 
+    def update(self):
+        """
+        Regenerates the output of this node after its skip_generation_paths changed,
+        template nodes override this so their children are not walked again.
+        """
+        self.generate()
+
     def children_recursive(self) -> list:
         r = []
         for c in self.children.values():
@@ -119,9 +211,16 @@ class Node:
     def exists(self):
         return self.get_output_path().exists()
 
+    @resolved
     def get_absolute_output(self):
         return self.get_root_node().get_output_folder()
 
+    def each_target(self):
+        """
+        Switches the root node to each build target in turn, see App.each_target
+        """
+        yield self.target
+
     def get_root_node(self):
         if self.app:
             return self.app
@@ -135,6 +234,26 @@ class Node:
         """
         [c.grow() for c in self.children.values()]
 
+    def grow_paths(self):
+        """
+        Directories whose listing decides the children of this node, see regrow
+        """
+        return []
+
+    def regrow(self):
+        """
+        Throws away the children and grows them again after the grow_paths changed.
+        """
+        self.children = {}
+        self.grow()
+        self.after_grow()
+
+    def after_grow(self):
+        """
+        Called bottom-up once the whole tree has grown and all I/O of the grow phase is done.
+        """
+        [c.after_grow() for c in self.children.values()]
+
     def process_feed(self, feed):
         if not self.indexable:
             return
@@ -152,3 +271,22 @@ class Node:
 
     def build_context(self):
         return {}
+
+
+class LeafNode(Node):
+    """
+    Node without children and own config. There is one per picture so it has no __dict__,
+    subclasses list their attributes in __slots__.
+    """
+
+    __slots__ = ("parent", "app")
+    children = MappingProxyType({})
+    config = MappingProxyType({})
+
+    def __init__(self, parent=None, app=None):
+        self.parent = parent
+        self.app = app
+
+    def get_resolved(self, key, func):
+        # one dict per leaf would cost more than walking up to the parent
+        return func()
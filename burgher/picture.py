@@ -1,36 +1,169 @@
 import hashlib
+import json
 import os
+import sys
+from dataclasses import dataclass, fields
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
-import exifread
-from PIL import Image as PILImage
-from PIL import ImageOps
-
-from .defaults import DEFAULT_DATE, THUMB_SIZES
-from .node import Node
-from .utils import get_name, parse_exif_date, parse_interesting_tags
-
-
-class Thumb(Node):
+from .defaults import DEFAULT_DATE, THUMB_FORMATS, THUMB_SIZES
+from .hash_utils import sampled_digest
+from .node import LeafNode
+from .utils import (
+    get_name,
+    link_or_copy,
+    parse_exif_date,
+    parse_interesting_tags,
+    parse_thumb_size,
+)
+
+
+@dataclass(slots=True)
+class PictureContext:
+    """
+    Cached metadata of one picture, stored in the context db as a dict
+    """
+
+    date: str = None
+    iso: str = None
+    aperture: str = None
+    length: str = None
+    shutter: str = None
+    model: str = None
+    lens: str = None
+    size_x: int = None
+    size_y: int = None
+    thumbs: dict = None
+    content_hash: str = None
+    placeholder: str = None
+    color: str = None
+    # thumbnail size -> digest of the encoder profile its files were made with
+    thumb_profiles: dict = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PictureContext":
+        context = cls()
+        context.update(data)
+        return context
+
+    def update(self, data: dict):
+        for key, value in data.items():
+            if key not in CONTEXT_FIELDS:
+                continue
+            # a few cameras and lenses are shared by thousands of pictures
+            if key in ("model", "lens") and value:
+                value = sys.intern(value)
+            setattr(self, key, value)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in CONTEXT_FIELDS}
+
+
+CONTEXT_FIELDS = tuple(f.name for f in fields(PictureContext))
+
+
+def profile_digest(profile: dict) -> str:
+    data = json.dumps(profile, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()[:12]
+
+
+class Thumb(LeafNode):
+    """
+    One thumbnail size of a picture, created on demand by Picture.get_thumbs
+    """
+
+    __slots__ = ("size", "name")
     indexable = False
-    size_x = None
-    size_y = None
 
-    def __init__(self, size, **kwargs):
+    def __init__(self, size, name=None, **kwargs):
         super().__init__(**kwargs)
         self.size = size
-        self.size_x, self.size_y = size
+        self.name = name
 
-    def set_real_size(self):
-        im = PILImage.open(self.get_output_path())
-        self.size_y, self.size_x = im.size
+    @property
+    def size_x(self):
+        return self.size[0]
+
+    @property
+    def size_y(self):
+        return self.size[1]
+
+    def get_name(self):
+        return self.name
+
+    def get_dimensions(self):
+        return self.parent.get_thumb_dimensions()[self.name]
 
     def get_width(self):
-        if not self.size_x:
-            self.set_real_size()
-        return self.size_x
+        return self.get_dimensions()[0]
+
+    def get_height(self):
+        return self.get_dimensions()[1]
+
+    def get_profile(self) -> dict:
+        """
+        Encoder profile of this size, thumb_profiles["default"] updated with
+        thumb_profiles[size] from the config
+        """
+        profiles = self.get_config("thumb_profiles") or {}
+        profile = dict(profiles.get("default", {}))
+        profile.update(profiles.get(self.name, {}))
+        return profile
+
+    def get_formats(self) -> list[str]:
+        """
+        Extra formats saved next to the thumbnail, e.g. ["avif", "webp"]
+        """
+        formats = self.get_profile().get("formats", [])
+        if not formats:
+            return []
+
+        from .thumbnails import format_supported
+
+        return [f for f in formats if format_supported(f)]
+
+    def get_format_path(self, fmt) -> Path:
+        return self.get_output_path().with_suffix(THUMB_FORMATS[fmt].extension)
+
+    def get_format_link(self, fmt):
+        return self.get_link_to(self.get_format_path(fmt))
+
+    def get_output_files(self):
+        return [self.get_output_path()] + [
+            self.get_format_path(f) for f in self.get_formats()
+        ]
+
+    def get_outputs(self) -> list:
+        """
+        (output_path, pillow save options) of every file of this thumbnail
+        """
+        from .thumbnails import encoder_options, source_format
+
+        profile = self.get_profile()
+        output_path = self.get_output_path()
+        outputs = [(output_path, encoder_options(profile, source_format(output_path)))]
+        for fmt in self.get_formats():
+            options = encoder_options(profile, fmt, extra_format=True)
+            outputs.append((self.get_format_path(fmt), options))
+        return outputs
+
+    def exists(self):
+        return all(path.exists() for path in self.get_output_files())
+
+    def get_profile_digest(self) -> str:
+        return self.parent.get_profile_digests()[self.name]
+
+    def get_store_name(self, path):
+        """
+        Name of the thumbnail file in the content store, files encoded with other profiles
+        are stored under other names
+        """
+        return f"{self.name}-{self.get_profile_digest()}{path.suffix}"
 
     def get_output_folder(self):
         return self.parent.get_output_folder() / (str(self.size_x) + "x")
@@ -39,40 +172,69 @@ class Thumb(Node):
         return self.parent.get_output_name()
 
     def generate_pillow(self, path):
-        with PILImage.open(path) as pillow_img_obj:
-            pillow_img_obj = ImageOps.exif_transpose(pillow_img_obj)
-            pillow_img_obj.thumbnail(self.size, PILImage.ANTIALIAS)
-            pillow_img_obj.save(str(self.get_output_path()))
+        from .thumbnails import generate_thumbnails
 
+        generate_thumbnails(path, [(self.size, self.get_outputs())])
 
-class Picture(Node):
-    path: Path
-    indexable = False
 
-    interesting_tags = {}
-    tags_parsed = {}
+class Picture(LeafNode):
+    """
+    Leaf of the album tree, there is one per photo so it is kept small: thumbnails are
+    made from thumb_sizes on first use and the context is a PictureContext record.
+    """
 
-    date = None
+    __slots__ = ("path", "thumb_sizes", "thumbs", "context", "date", "refreshed")
+    path: Path
+    indexable = False
 
     def __init__(self, path, thumb_sizes=THUMB_SIZES, **kwargs):
         super().__init__(**kwargs)
 
-        self.interesting_tags = {}
-
         self.path = path
         self.thumb_sizes = thumb_sizes
+        self.thumbs = None
+        self.context = None
+        self.date = None
+        self.refreshed = False
+
+        # stat and exif parsing are I/O bound, runs in the grow thread pool
+        self.app.submit_io(self.rebuild)
+
+    def get_thumbs(self) -> tuple[Thumb, ...]:
+        if self.thumbs is None:
+            self.thumbs = tuple(
+                Thumb(parse_thumb_size(size), name=size, parent=self, app=self.app)
+                for size in self.thumb_sizes
+            )
+        return self.thumbs
+
+    def get_output_files(self):
+        return [
+            path for thumb in self.get_thumbs() for path in thumb.get_output_files()
+        ]
+
+    def get_profile_digests(self) -> dict:
+        """
+        Digest of the encoder profile of every thumbnail size. Pictures have no config of
+        their own, so it is resolved once per album.
+        """
+        return self.parent.get_resolved(
+            ("thumb_profiles", tuple(self.thumb_sizes)),
+            lambda: {
+                t.name: profile_digest(t.get_profile()) for t in self.get_thumbs()
+            },
+        )
 
-        self.rebuild()
-
-    def grow(self):
-        for size in self.thumb_sizes:
-            size_x, size_y = size.split("x")
-            x = int(size_x) if size_x != "" else None
-            y = int(size_y) if size_y != "" else None
-
-            self.children[size] = Thumb(size=(x, y), parent=self, app=self.app)
-
-        super().grow()
+    def thumbs_stale(self, thumbs) -> bool:
+        """
+        Thumbnails were encoded with other profiles or the picture was edited in place
+        """
+        recorded = self.context.thumb_profiles
+        # None for thumbnails of builds that did not record profiles, they are kept
+        if recorded is not None and recorded != self.get_profile_digests():
+            return True
+        # only pictures whose context was rebuilt can have changed since their thumbnails
+        return self.refreshed and self.thumbs_outdated(thumbs)
 
     # noinspection PyTypeChecker
     def get_info(self):
@@ -137,49 +299,176 @@ class Picture(Node):
 
     @property
     def smallest_thumb(self):
-        for size in self.thumb_sizes:
-            if size in self.children:
-                return self.children[size]
+        return self.get_thumbs()[0]
 
     @property
     def largest_thumb(self):
-        for size in reversed(self.thumb_sizes):
-            if size in self.children:
-                return self.children[size]
-        return self.children.pop()
+        return self.get_thumbs()[-1]
+
+    def get_thumb_dimensions(self) -> dict:
+        """
+        Thumbnail sizes computed from the source size, so no thumbnail has to be opened.
+        """
+        dimensions = self.context.thumbs or {}
+        if not all(size in dimensions for size in self.thumb_sizes):
+            from .thumbnails import thumbnail_dimensions
+
+            dimensions = thumbnail_dimensions(
+                {size: parse_thumb_size(size) for size in self.thumb_sizes},
+                self.context.size_x,
+                self.context.size_y,
+                jpeg=self.path.suffix.lower() in (".jpg", ".jpeg"),
+            )
+            self.update_context({"thumbs": dimensions})
+        return dimensions
 
     @property
     def ratio(self) -> float:
-        return self.context["size_x"] / self.context["size_y"]
+        return self.context.size_x / self.context.size_y
 
     # noinspection PyTypeChecker
     def generate(self):
         super().generate()
+
+        job = self.get_thumbnail_job()
+        if job:
+            from .thumbnails import generate_thumbnails
+
+            with self.app.profile.phase("thumbnails"):
+                data = generate_thumbnails(*job)
+            self.finish_thumbnail_job(data)
+
+        if self.context.placeholder is None:
+            from .thumbnails import read_placeholder
+
+            # thumbnails were made by an older build or restored from the content store
+            with self.app.profile.phase("placeholders"):
+                data = read_placeholder(self.smallest_thumb.get_output_path())
+            self.update_context(data)
+
+        if self.app.local_build:
+            self.link_targets()
+
+    def link_targets(self):
+        """
+        Hard links the thumbnails of the deployed build into the other build targets
+        instead of generating them again.
+        """
+        app = self.app
+        sources = self.get_output_files()
+        for _ in app.each_target(app.get_targets()[1:]):
+            for source, path in zip(sources, self.get_output_files()):
+                # thumbnails generated again are new files the old links miss
+                if path.exists() and os.path.samefile(source, path):
+                    continue
+                os.makedirs(path.parent, exist_ok=True)
+                link_or_copy(source, path)
+                app.profile.count(self, "thumbnails_linked")
+
+    def thumbs_outdated(self, thumbs) -> bool:
+        """
+        Some thumbnail is older than the source, i.e. the picture was edited in place
+        """
+        source_mtime = os.stat(self.path).st_mtime
+        return any(
+            path.exists() and path.stat().st_mtime < source_mtime
+            for thumb in thumbs
+            for path in thumb.get_output_files()
+        )
+
+    def get_thumbnail_job(self):
+        """
+        Arguments for generate_thumbnails or None if all thumbnails exist and are up to date
+        """
         # Imagemagick is slow as fuck so I try to avoid it.
-        thumbs_exists = all([c.exists() for c in self.children.values()])
+        thumbs = self.get_thumbs()
+
+        if self.thumbs_stale(thumbs):
+            for thumb in thumbs:
+                for path in thumb.get_output_files():
+                    # may be hard linked to the content store, it must keep the old file
+                    path.unlink(missing_ok=True)
+            self.app.profile.count(self, "thumbnails_outdated")
+
+        thumbs_exists = all([c.exists() for c in thumbs])
+
+        store = self.app.content_store
+        if not thumbs_exists and store:
+            content_hash = self.get_content_hash()
+            thumbs_exists = True
+            for c in thumbs:
+                for path in c.get_output_files():
+                    if path.exists():
+                        continue
+                    name = c.get_store_name(path)
+                    if not store.restore(content_hash, name, path):
+                        thumbs_exists = False
 
-        # if not self.refreshed and thumbs_exists:
         if thumbs_exists:
+            digests = self.get_profile_digests()
+            if self.context.thumb_profiles != digests:
+                # restored from the store under names of the current profiles
+                self.update_context({"thumb_profiles": digests})
+            return None
+
+        for thumb in thumbs:
+            os.makedirs(thumb.get_output_folder(), exist_ok=True)
+
+        return (self.path, [(thumb.size, thumb.get_outputs()) for thumb in thumbs])
+
+    def finish_thumbnail_job(self, data):
+        """
+        Called with the result of generate_thumbnails
+        """
+        self.update_context({**data, "thumb_profiles": self.get_profile_digests()})
+
+        files = [
+            (thumb, path)
+            for thumb in self.get_thumbs()
+            for path in thumb.get_output_files()
+        ]
+
+        manifest = self.app.get_manifest()
+        for _, path in files:
+            manifest.record(path)
+
+        self.app.profile.count(self, "thumbnails_encoded", len(files))
+        self.app.profile.count(
+            self, "bytes_written", sum(path.stat().st_size for _, path in files)
+        )
+
+        store = self.app.content_store
+        if store:
+            content_hash = self.get_content_hash()
+            for thumb, path in files:
+                store.add(content_hash, thumb.get_store_name(path), path)
+
+    def update_context(self, data):
+        """
+        Merges context computed outside of build_context (e.g. in a worker process)
+        """
+        if not data:
             return
 
-        for thumb in self.children.values():
-            thumb.generate_pillow(self.path)
+        self.context.update(data)
+        self.app.context_db.set_key(
+            str(self.path), self.get_mtime(), self.context.to_dict()
+        )
 
     def build_context(self):
-        # noinspection PyTypeChecker
-        with open(self.path, "rb") as f:
-            tags = exifread.process_file(f, details=False)
-            orientation = tags.get("Image Orientation")
+        # pillow and exifread are only needed for new or changed pictures
+        from .metadata import read_metadata
+
+        with self.app.profile.phase("metadata"):
+            tags, size = read_metadata(self.path)
+        orientation = tags.get("Image Orientation")
 
-        interesting_tags, tags_parsed = parse_interesting_tags(tags)
-        im = PILImage.open(self.path)
+        tags_parsed = parse_interesting_tags(tags)
         # handle rotated images:
         if orientation and (6 in orientation.values or 8 in orientation.values):
-            size_y, size_x = im.size
+            size_y, size_x = size
         else:
-            size_x, size_y = im.size
-
-        im.close()
+            size_x, size_y = size
 
         if "Image DateTimeOriginal" in tags:
             date = parse_exif_date(tags["Image DateTimeOriginal"])
@@ -190,8 +479,6 @@ class Picture(Node):
         else:
             date = DEFAULT_DATE
 
-        self.date = date
-
         model = tags_parsed.get("model")
         lens = tags_parsed.get("lens")
         iso = tags_parsed.get("iso")
@@ -211,13 +498,66 @@ class Picture(Node):
             "size_x": size_x,
         }
 
-    def get_srcset(self):
+    def get_srcset(self, fmt=None):
+        """
+        srcset of the thumbnails in the source format or in one of the extra formats
+        """
+        if fmt is None:
+            return ",".join(
+                [f"{t.get_link()} {t.get_width()}w" for t in self.get_thumbs()]
+            )
         return ",".join(
-            [f"{t.get_link()} {t.get_width()}w" for t in self.children.values()]
+            [
+                f"{t.get_format_link(fmt)} {t.get_width()}w"
+                for t in self.get_thumbs()
+                if fmt in t.get_formats()
+            ]
         )
 
+    def get_placeholder(self) -> str:
+        """
+        data: URI of a tiny preview to show while the thumbnails load
+        """
+        return self.context.get("placeholder", "")
+
+    def get_color(self) -> str:
+        return self.context.get("color", "")
+
+    def get_sources(self) -> list[dict]:
+        """
+        type and srcset of a <source> for every extra thumbnail format in configured order
+        """
+        formats = []
+        for thumb in self.get_thumbs():
+            formats.extend(f for f in thumb.get_formats() if f not in formats)
+        return [
+            {"type": THUMB_FORMATS[fmt].mime, "srcset": self.get_srcset(fmt)}
+            for fmt in formats
+        ]
+
     def get_json(self):
-        return self.context
+        """
+        What a client needs to show the picture, e.g. for the album JSON sidecar. The
+        placeholder is only included with json_placeholders=True, it is the biggest part.
+        """
+        context = self.context
+        data = {
+            "name": self.get_name(),
+            "date": context.date,
+            "info": self.get_info(),
+            "model": context.model,
+            "lens": context.lens,
+            "width": context.size_x,
+            "height": context.size_y,
+            "color": context.color,
+            "src": self.smallest_thumb.get_link(),
+            "srcset": self.get_srcset(),
+            "sources": self.get_sources(),
+            "link": self.largest_thumb.get_link(),
+        }
+        if self.get_config("json_placeholders"):
+            data["placeholder"] = context.placeholder
+        return data
 
     def get_mtime(self) -> Optional[str]:
         stat = os.stat(self.path)
@@ -228,14 +568,53 @@ class Picture(Node):
         h.update(self.get_mtime().encode())
         return h.hexdigest()
 
+    def get_content_hash(self) -> str:
+        if self.context.content_hash is None:
+            self.update_context({"content_hash": sampled_digest(self.path)})
+        return self.context.content_hash
+
+    def find_moved_context(self, content_hash) -> Optional[PictureContext]:
+        """
+        Context of the same file cached under a different path
+        """
+        if not content_hash:
+            return None
+
+        data = self.get_cached(f"content:{content_hash}", content_hash)
+        if data:
+            return PictureContext.from_dict(data)
+        return None
+
     def rebuild(self):
         file_hash = self.get_mtime()
-        data = self.app.context_db.get_key(str(self.path), file_hash)
+        data = self.get_cached(str(self.path), file_hash)
         if data:
             self.refreshed = False
-            self.context = data
-            self.date = datetime.fromisoformat(data["date"])
+            self.context = PictureContext.from_dict(data)
         else:
             self.refreshed = True
-            self.context = self.build_context()
-            self.app.context_db.set_key(str(self.path), file_hash, self.context)
+            content_hash = None
+            if self.app.content_store:
+                content_hash = sampled_digest(self.path)
+
+            self.context = self.find_moved_context(content_hash)
+            if not self.context:
+                self.context = PictureContext.from_dict(self.build_context())
+                self.context.content_hash = content_hash
+            self.app.context_db.set_key(
+                str(self.path), file_hash, self.context.to_dict()
+            )
+        self.date = datetime.fromisoformat(self.context.date)
+
+        self.get_thumb_dimensions()
+
+        if self.app.content_store:
+            content_stored = bool(data) and self.context.content_hash is not None
+            content_hash = self.get_content_hash()
+            content_key = f"content:{content_hash}"
+            if content_stored:
+                self.app.context_db.mark_used(content_key)
+            else:
+                self.app.context_db.set_key(
+                    content_key, content_hash, self.context.to_dict()
+                )
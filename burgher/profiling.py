@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class BuildProfile:
+    """
+    Collects timings of build phases, per node class counters and album generation times.
+
+    Phases that run in threads (e.g. metadata) are summed over all threads, so they can
+    add up to more than the wall clock time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = defaultdict(lambda: {"seconds": 0.0, "calls": 0})
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.node_times = {}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.phases[name]["seconds"] += elapsed
+                self.phases[name]["calls"] += 1
+
+    def count(self, node, counter, n=1):
+        with self.lock:
+            self.counters[type(node).__name__][counter] += n
+
+    def total(self, counter) -> int:
+        """
+        Sum of the counter over all node classes
+        """
+        with self.lock:
+            return sum(c.get(counter, 0) for c in self.counters.values())
+
+    def node_time(self, node, seconds):
+        """
+        Time spent generating the node including its children
+        """
+        with self.lock:
+            if node not in self.node_times:
+                self.node_times[node] = [str(node.get_output_path()), 0.0]
+            self.node_times[node][1] += seconds
+
+    def slowest_nodes(self, top=10) -> list[dict]:
+        rows = []
+        for node, (label, seconds) in self.node_times.items():
+            children = sum(
+                self.node_times[c][1]
+                for c in node.children.values()
+                if c in self.node_times
+            )
+            rows.append(
+                {
+                    "node": label,
+                    "seconds": round(seconds - children, 4),
+                    "seconds_with_children": round(seconds, 4),
+                }
+            )
+        rows.sort(key=lambda r: r["seconds"], reverse=True)
+        return rows[:top]
+
+    def report(self, top=10) -> dict:
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "phases": {
+                name: {"seconds": round(p["seconds"], 4), "calls": p["calls"]}
+                for name, p in self.phases.items()
+            },
+            "counters": {k: dict(v) for k, v in self.counters.items()},
+            "slowest_albums": self.slowest_nodes(top),
+        }
+
+    def dump(self, path, top=10):
+        with open(path, "w") as f:
+            f.write(json.dumps(self.report(top), indent=2))
+
+    def print_summary(self, top=10):
+        report = self.report(top)
+        print(f"Build took {report['total_seconds']:.2f}s")
+        for name, p in sorted(
+            report["phases"].items(), key=lambda i: i[1]["seconds"], reverse=True
+        ):
+            print(f"  {name:<12} {p['seconds']:>10.2f}s {p['calls']:>8} calls")
+        for node_class, counters in report["counters"].items():
+            values = ", ".join(f"{k}: {v}" for k, v in sorted(counters.items()))
+            print(f"  {node_class}: {values}")
+        if report["slowest_albums"]:
+            print(f"Slowest {top} albums:")
+            for row in report["slowest_albums"]:
+                print(f"  {row['seconds']:>8.2f}s {row['node']}")
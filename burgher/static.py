@@ -1,7 +1,8 @@
-import shutil
+import os
 from pathlib import Path
 
-from .node import Node
+from .node import Node, resolved
+from .utils import sync_file, sync_folder
 
 
 class StaticFolderNode(Node):
@@ -13,6 +14,7 @@ class StaticFolderNode(Node):
         super().__init__(**config)
         self.folder = Path(folder).resolve()
 
+    @resolved
     def get_output_folder(self):
         return super().get_output_folder() / self.get_name()
 
@@ -22,17 +24,34 @@ class StaticFolderNode(Node):
     def skip_generation_paths(self):
         return [self.folder]
 
+    def get_output_files(self):
+        out = self.get_output_folder()
+        files = []
+        for dirpath, _, filenames in os.walk(self.folder, followlinks=True):
+            relative = Path(dirpath).relative_to(self.folder)
+            files.extend(out / relative / name for name in filenames)
+        return files
+
     def generate(self):
-        """
-        TODO: deal with shutil so that we don't have to delete the directory
-        """
         if not self.skip_generation():
-            out = self.get_output_folder()
-            if out.exists():
-                shutil.rmtree(out)
-            shutil.copytree(self.folder, self.get_output_folder())
+            for _ in self.get_root_node().each_target():
+                self.sync()
         super().generate()
 
+    def sync(self):
+        """
+        Copies only changed files so unchanged outputs keep their mtimes
+        """
+        app = self.get_root_node()
+        with app.profile.phase("static"):
+            copied, unchanged, deleted = sync_folder(
+                self.folder, self.get_output_folder()
+            )
+            record_copied(self, copied)
+
+        app.profile.count(self, "files_unchanged", unchanged)
+        app.profile.count(self, "files_deleted", len(deleted))
+
 
 class StaticNode(Node):
     """
@@ -49,10 +68,27 @@ class StaticNode(Node):
     def skip_generation_paths(self):
         return [self.file]
 
+    def get_output_files(self):
+        return [self.get_output_folder() / self.file.name]
+
     def generate(self):
-        """
-        TODO: deal with shutil so that we don't have to delete the directory
-        """
         if not self.skip_generation():
-            shutil.copy(self.file, self.get_output_folder())
+            app = self.get_root_node()
+            for _ in app.each_target():
+                out = self.get_output_folder() / self.file.name
+                os.makedirs(out.parent, exist_ok=True)
+                with app.profile.phase("static"):
+                    if sync_file(self.file, out):
+                        record_copied(self, [out])
+                    else:
+                        app.profile.count(self, "files_unchanged")
         super().generate()
+
+
+def record_copied(node: Node, copied: list[Path]):
+    app = node.get_root_node()
+    manifest = app.get_manifest()
+    for path in copied:
+        manifest.record(path)
+        app.profile.count(node, "bytes_written", path.stat().st_size)
+    app.profile.count(node, "files_changed", len(copied))
@@ -1,13 +1,11 @@
+import os
 from datetime import datetime
 from os.path import splitext
 from pathlib import Path
 
-import frontmatter
-import markdown2
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-
 from .node import Node
 from .static import StaticFolderNode
+from .utils import write_if_changed
 
 
 def path_not_ignored(f: Path):
@@ -34,24 +32,112 @@ class TemplateNode(Node):
         return {
             # "node": self,
             self.template_node_name: self,
-            "base_link": self.get_base_link_url(),
             "now": datetime.now(),
+            **self.get_target_context(),
         }
 
+    def get_target_context(self) -> dict:
+        """
+        The part of get_extra_context that differs between build targets, i.e. links
+        """
+        return {"base_link": self.get_base_link_url()}
+
     def generate(self):
         skip = self.skip_generation()
         super().generate()
 
         if skip:
+            for path in self.markdown_paths():
+                self.keep_markdown(path)
             return
 
-        env = Environment(
-            loader=FileSystemLoader(self.get_config("template_dir")),
-            autoescape=select_autoescape(["html", "xml"]),
+        self.render_targets()
+
+    def update(self):
+        if not self.skip_generation():
+            self.render_targets()
+
+    def render_targets(self):
+        """
+        Renders the node for every build target in one go, the context (sorted pictures,
+        EXIF, markdown) is computed once and only get_target_context is swapped.
+        """
+        context = None
+        for _ in self.get_root_node().each_target():
+            os.makedirs(self.get_output_folder(), exist_ok=True)
+            if context is None:
+                context = self.get_extra_context()
+            else:
+                context.update(self.get_target_context())
+            self.render(context)
+
+    def render(self, context=None):
+        if context is None:
+            context = self.get_extra_context()
+
+        env = self.get_root_node().get_template_environment(
+            self.get_config("template_dir")
         )
-        template = env.get_template(self.template_name)
-        with open(self.get_output_path(), "w") as f:
-            f.write(template.render(**self.get_extra_context()))
+        profile = self.get_root_node().profile
+        with profile.phase("render"):
+            template = env.get_template(self.template_name)
+            html = template.render(**context).encode()
+            self.write_output(self.get_output_path(), html)
+
+        profile.count(self, "pages_rendered")
+
+    def write_output(self, path, content: bytes):
+        """
+        Writes a rendered file unless it is unchanged and records it in the manifest
+        """
+        profile = self.get_root_node().profile
+        changed = write_if_changed(path, content)
+        self.get_root_node().get_manifest().record(path, content)
+
+        if changed:
+            profile.count(self, "files_changed")
+            profile.count(self, "bytes_written", len(content))
+        else:
+            profile.count(self, "files_unchanged")
+
+    def markdown_paths(self) -> list:
+        """
+        Markdown files rendered by this node, see render_markdown
+        """
+        return []
+
+    def get_markdown_key(self, path) -> str:
+        return f"markdown:{os.path.abspath(path)}"
+
+    def keep_markdown(self, path):
+        """
+        Keeps the cached HTML of a skipped node from being purged
+        """
+        self.get_root_node().context_db.mark_used(self.get_markdown_key(path))
+
+    def render_markdown(self, path, content=None, extras=None) -> str:
+        """
+        HTML of the markdown file (or its content read already), cached in the context db
+        by the size and mtime of the file so unchanged sources are not converted again.
+        """
+        app = self.get_root_node()
+        stat = os.stat(path)
+        key = self.get_markdown_key(path)
+        file_hash = f"{stat.st_mtime_ns}:{stat.st_size}:{','.join(extras or [])}"
+
+        html = self.get_cached(key, file_hash)
+        if html is None:
+            if content is None:
+                content = Path(path).read_text(encoding="utf-8")
+            import markdown2
+
+            with app.profile.phase("markdown"):
+                html = str(markdown2.markdown(content, extras=extras))
+            app.context_db.set_key(key, file_hash, html)
+        return html
+
+    def get_output_files(self):
+        return [self.get_output_path()]
 
     def get_output_name(self):
         return self.template_name
@@ -86,9 +172,12 @@ class FileTemplateNode(TemplateNode):
 
 
 class MarkdownNode(FileTemplateNode):
+    def markdown_paths(self):
+        return [self.source_file]
+
     def get_extra_context(self):
         c = super().get_extra_context()
-        c["content"] = markdown2.markdown_path(self.source_file)
+        c["content"] = self.render_markdown(self.source_file)
         return c
 
 
@@ -97,6 +186,8 @@ class FrontMatterNode(FileTemplateNode):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        import frontmatter
+
         try:
             self.metadata = frontmatter.load(self.source_file)
         except Exception as e:
@@ -104,10 +195,17 @@ class FrontMatterNode(FileTemplateNode):
             raise e
 
         self.markdown_content = self.metadata.content
-        self.html_content = markdown2.markdown(
-            self.markdown_content, extras=self.markdown_extras
+
+    @property
+    def html_content(self):
+        # rendered on first use, pages that are skipped never need it
+        return self.render_markdown(
+            self.source_file, self.markdown_content, self.markdown_extras
         )
 
+    def markdown_paths(self):
+        return [self.source_file]
+
     def get_extra_context(self):
         c = super().get_extra_context()
         c["metadata"] = self.metadata
@@ -0,0 +1,254 @@
+import base64
+import functools
+import io
+import math
+from pathlib import Path
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from .defaults import THUMB_FORMATS
+
+try:
+    # registers AVIF with pillow, AVIF thumbnails are skipped without it
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# JPEG draft decoding only kicks in when the source is at least this many
+# times bigger than the largest thumbnail, same gap pillow's thumbnail() uses.
+DRAFT_REDUCING_GAP = 2.0
+
+# EXIF orientations that swap width and height
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+# Placeholders shown while thumbnails load are this many pixels on the longer side
+PLACEHOLDER_SIZE = 20
+PLACEHOLDER_QUALITY = 50
+
+# top-level options of a thumbnail profile that apply to the extra formats too,
+# strip_metadata is handled by save_thumbnail
+SHARED_ENCODER_OPTIONS = ("quality", "strip_metadata")
+
+
+@functools.cache
+def format_supported(name) -> bool:
+    if name not in THUMB_FORMATS:
+        raise ValueError(
+            f"Unknown thumbnail format {name}, use one of {', '.join(THUMB_FORMATS)}"
+        )
+
+    PILImage.init()
+    supported = THUMB_FORMATS[name].pillow_name in PILImage.SAVE
+    if not supported:
+        print(f"Pillow can not save {name}, {name} thumbnails are skipped")
+    return supported
+
+
+def source_format(path) -> str:
+    """
+    Lowercase pillow format of a file name, e.g. jpeg for .jpg
+    """
+    return PILImage.registered_extensions().get(Path(path).suffix.lower(), "").lower()
+
+
+def encoder_options(profile: dict, fmt: str, extra_format=False) -> dict:
+    """
+    Pillow save options of fmt from a thumbnail profile.
+
+    Options nested under the format name override the shared ones, e.g.
+    {"quality": 85, "jpeg": {"progressive": True}, "webp": {"quality": 75}}
+
+    Other top-level options are meant for the format of the source (e.g. progressive of
+    older configs), extra formats only get the ones all formats understand.
+    """
+    options = {
+        k: v
+        for k, v in profile.items()
+        if k != "formats"
+        and not isinstance(v, dict)
+        and (not extra_format or k in SHARED_ENCODER_OPTIONS)
+    }
+    options.update(profile.get(fmt, {}))
+    return options
+
+
+def thumbnail_scale(size, width, height) -> float:
+    """
+    Scale factor pillow's thumbnail() applies to fit (width, height) into size.
+    """
+    size_x, size_y = size
+    scales = [1.0]
+    if size_x:
+        scales.append(size_x / width)
+    if size_y:
+        scales.append(size_y / height)
+    return min(scales)
+
+
+def thumbnail_size(size, width, height) -> tuple[int, int]:
+    """
+    Size of the image after pillow's thumbnail(size), without touching any pixels.
+    """
+    size_x, size_y = size
+    x, y = math.floor(size_x or width), math.floor(size_y or height)
+    if x >= width and y >= height:
+        return width, height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(
+            x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n)
+        )
+    return x, y
+
+
+def draft_size(size, width, height):
+    """
+    Size to ask the JPEG decoder for when the biggest thumbnail is size, None when the
+    source is not big enough to be decoded reduced
+    """
+    scale = thumbnail_scale(size, width, height) * DRAFT_REDUCING_GAP
+    if scale >= 1:
+        return None
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def drafted_size(requested, width, height) -> tuple[int, int]:
+    """
+    Size of a JPEG after pillow's draft(None, requested), the decoder can only scale
+    by 1/8, 1/4, 1/2 or 1 and rounds up
+    """
+    scale = min(width // requested[0], height // requested[1])
+    factor = next((s for s in (8, 4, 2) if scale >= s), 1)
+    return (width + factor - 1) // factor, (height + factor - 1) // factor
+
+
+def thumbnail_dimensions(sizes: dict, width, height, jpeg=False) -> dict:
+    """
+    Dimensions of every thumbnail generate_thumbnails makes from width x height source.
+
+    sizes maps names to (x, y) boxes, same draft and cascade as in generate_thumbnails
+    are applied, the draft only to JPEG sources.
+    """
+    ordered = sorted(
+        sizes.items(),
+        key=lambda item: thumbnail_scale(item[1], width, height),
+        reverse=True,
+    )
+
+    if jpeg and ordered:
+        requested = draft_size(ordered[0][1], width, height)
+        if requested:
+            width, height = drafted_size(requested, width, height)
+
+    dimensions = {}
+    for name, size in ordered:
+        width, height = thumbnail_size(size, width, height)
+        dimensions[name] = [width, height]
+    return dimensions
+
+
+def generate_thumbnails(path, thumbs):
+    """
+    Decodes the source image once and saves all thumbnails from it.
+
+    thumbs is a list of (size, outputs) tuples, outputs are (output_path, save_options)
+    of every format of the thumbnail. The biggest thumbnail is made first and every
+    smaller one is downscaled from the previous result.
+
+    Returns dict with any context computed on the way, this runs in worker
+    processes so it must stay picklable.
+    """
+    context = {}
+    if not thumbs:
+        return context
+
+    with PILImage.open(path) as pillow_img_obj:
+        width, height = pillow_img_obj.size
+        orientation = pillow_img_obj.getexif().get(0x0112)
+        if orientation in ROTATED_ORIENTATIONS:
+            width, height = height, width
+
+        thumbs = sorted(
+            thumbs, key=lambda t: thumbnail_scale(t[0], width, height), reverse=True
+        )
+
+        # Let the JPEG decoder do the heavy lifting if we need way less pixels:
+        requested = draft_size(thumbs[0][0], width, height)
+        if requested:
+            if orientation in ROTATED_ORIENTATIONS:
+                requested = requested[::-1]
+            pillow_img_obj.draft(None, requested)
+
+        pillow_img_obj = ImageOps.exif_transpose(pillow_img_obj)
+
+        for size, outputs in thumbs:
+            save_thumbnail(pillow_img_obj, size, outputs)
+
+        # the image is the smallest thumbnail now, cheap to shrink further
+        context.update(placeholder_context(pillow_img_obj))
+
+    return context
+
+
+def placeholder_context(pillow_img_obj) -> dict:
+    """
+    Tiny base64 JPEG preview and average colour of the image
+    """
+    size = thumbnail_size(
+        (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE),
+        pillow_img_obj.width,
+        pillow_img_obj.height,
+    )
+    preview = pillow_img_obj
+    if preview.mode != "RGB":
+        preview = preview.convert("RGB")
+    preview = preview.resize(size, PILImage.BOX)
+
+    buffer = io.BytesIO()
+    preview.save(buffer, "JPEG", quality=PLACEHOLDER_QUALITY, optimize=True)
+    red, green, blue = preview.resize((1, 1), PILImage.BOX).getpixel((0, 0))
+    return {
+        "placeholder": "data:image/jpeg;base64,"
+        + base64.b64encode(buffer.getvalue()).decode(),
+        "color": f"#{red:02x}{green:02x}{blue:02x}",
+    }
+
+
+def read_placeholder(path) -> dict:
+    """
+    Placeholder context of an existing thumbnail, used when no thumbnail had to be made
+    """
+    with PILImage.open(path) as pillow_img_obj:
+        pillow_img_obj.draft("RGB", (PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        return placeholder_context(pillow_img_obj)
+
+
+def save_thumbnail(pillow_img_obj, size, outputs):
+    """
+    Shrinks the image in place and saves it in every format of outputs.
+
+    Metadata is dropped unless the save options have strip_metadata=False, then the
+    EXIF and colour profile of the source are kept.
+    """
+    size_x, size_y = size
+    box = (size_x or pillow_img_obj.width, size_y or pillow_img_obj.height)
+    pillow_img_obj.thumbnail(box, PILImage.ANTIALIAS)
+
+    for output_path, options in outputs:
+        options = dict(options)
+        if not options.pop("strip_metadata", True):
+            for key in ("exif", "icc_profile"):
+                if key in pillow_img_obj.info:
+                    options.setdefault(key, pillow_img_obj.info[key])
+
+        # the old file may be hard linked from the content store, never write into it
+        Path(output_path).unlink(missing_ok=True)
+        pillow_img_obj.save(str(output_path), **options)
@@ -1,9 +1,32 @@
+import hashlib
 import os
+import shutil
+import tempfile
 from datetime import datetime
 from fractions import Fraction
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
 
 from .defaults import PICTURE_EXTENSIONS, EXIF_INTERESTING_TAGS
 
+# ioctl cloning a file on copy on write filesystems (btrfs, xfs) on linux
+FICLONE = 0x40049409
+
+
+def get_umask() -> int:
+    # there is no way to read it without setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# mode of new files written through a temporary file, as open() would create them
+NEW_FILE_MODE = 0o666 & ~get_umask()
+
 
 def user_prompt(question: str) -> bool:
     """Prompt the yes/no-*question* to the user."""
@@ -17,6 +40,214 @@ def user_prompt(question: str) -> bool:
     return False
 
 
+def link_or_copy(src, dst):
+    """
+    Hard links src to dst, copies when linking is not possible (e.g. different filesystem).
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def reflink(src, dst) -> bool:
+    """
+    Clones src to a new file dst sharing its blocks, False if the filesystem can't do it.
+    """
+    if fcntl is None:
+        return False
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            cloned = True
+        except OSError:
+            cloned = False
+
+    if not cloned:
+        os.unlink(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def clone_file(src, dst):
+    """
+    Copies src to dst as a reflink, a hard link or a plain copy, whichever works first.
+    The old dst is replaced, never written into, as it may be a hard link to a source.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if not reflink(src, dst):
+        link_or_copy(src, dst)
+
+
+def same_content(src, dst) -> bool:
+    """
+    Size and mtime tell a copy made by clone_file, digests are compared only when the
+    sizes match but mtimes don't (e.g. after a fresh checkout of the sources).
+    """
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+
+    src_stat = os.stat(src)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+
+    digests = []
+    for path in (src, dst):
+        with open(path, "rb") as f:
+            digests.append(hashlib.file_digest(f, "sha256").digest())
+    return digests[0] == digests[1]
+
+
+def sync_file(src, dst) -> bool:
+    """
+    Copies src to dst unless dst has the same content, returns True if it copied.
+    """
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    if same_content(src, dst):
+        return False
+    clone_file(src, dst)
+    return True
+
+
+def sync_folder(src, dst) -> tuple[list[Path], int, list[Path]]:
+    """
+    Makes dst a copy of src: changed files are copied, files missing in src are deleted and
+    unchanged files are left alone. Returns (copied files, unchanged count, deleted files).
+    """
+    src, dst = Path(src), Path(dst)
+    copied = []
+    unchanged = 0
+    expected = {dst}
+
+    for dirpath, _, filenames in os.walk(src, followlinks=True):
+        out_dir = dst / Path(dirpath).relative_to(src)
+        if out_dir.is_symlink() or out_dir.is_file():
+            out_dir.unlink()
+        os.makedirs(out_dir, exist_ok=True)
+        expected.add(out_dir)
+
+        for name in filenames:
+            out = out_dir / name
+            expected.add(out)
+            if sync_file(os.path.join(dirpath, name), out):
+                copied.append(out)
+            else:
+                unchanged += 1
+
+    deleted = []
+    for dirpath, dirnames, filenames in os.walk(dst, topdown=False):
+        for name in filenames:
+            path = Path(dirpath) / name
+            if path not in expected:
+                path.unlink()
+                deleted.append(path)
+        for name in dirnames:
+            path = Path(dirpath) / name
+            if path not in expected:
+                if path.is_symlink():
+                    path.unlink()
+                else:
+                    path.rmdir()
+
+    return copied, unchanged, deleted
+
+
+def replace_if_changed(path, size, digest: str, write) -> bool:
+    """
+    Unless path has this size and sha256 hex digest already, write(tmp_path) creates a
+    temporary file next to it which atomically replaces path.
+    Returns True if the file was written.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        stat = None
+
+    if stat is not None and stat.st_size == size:
+        with open(path, "rb") as f:
+            old_digest = hashlib.file_digest(f, "sha256").hexdigest()
+        if old_digest == digest:
+            return False
+
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.chmod(tmp_path, stat.st_mode & 0o777 if stat else NEW_FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+
+def write_if_changed(path, content: bytes) -> bool:
+    """
+    Atomically replaces the file unless it already has the same content.
+    Returns True if the file was written.
+    """
+    return replace_if_changed(
+        path,
+        len(content),
+        hashlib.sha256(content).hexdigest(),
+        lambda tmp_path: Path(tmp_path).write_bytes(content),
+    )
+
+
+class StreamIfChanged:
+    """
+    write_if_changed for content too big to keep in memory: the content is streamed into a
+    temporary file which replaces path on exit only if it differs from the old file.
+    changed, size and digest are set when the with block ends.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.hash = hashlib.sha256()
+        self.changed = None
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        fd, self.tmp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+        self.file = os.fdopen(fd, "wb")
+        return self
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    @property
+    def digest(self) -> str:
+        return self.hash.hexdigest()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is None:
+            self.changed = replace_if_changed(
+                self.path,
+                self.size,
+                self.digest,
+                lambda tmp_path: os.replace(self.tmp_path, tmp_path),
+            )
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+        return False
+
+
 def parse_exif_date(dt) -> datetime:
     return datetime.strptime(str(dt.values), "%Y:%m:%d %H:%M:%S")
 
@@ -26,6 +257,16 @@ def get_name(filename):
     return filename
 
 
+def parse_thumb_size(size: str):
+    """
+    "1920x1080" -> (1920, 1080), missing side is None
+    """
+    size_x, size_y = size.split("x")
+    x = int(size_x) if size_x != "" else None
+    y = int(size_y) if size_y != "" else None
+    return x, y
+
+
 def is_pic(filename):
     filename, file_extension = os.path.splitext(filename)
     return file_extension.lower() in PICTURE_EXTENSIONS
@@ -49,11 +290,8 @@ def get_exif_tag_value(value):
 
 
 def parse_interesting_tags(tags):
-    interesting_tags = {}
     parsed = {}
     for tag, name in EXIF_INTERESTING_TAGS.items():
         if tag in tags:
-            value = tags[tag]
-            interesting_tags[name] = value.printable
-            parsed[name] = get_exif_tag_value(value)
-    return interesting_tags, parsed
+            parsed[name] = get_exif_tag_value(tags[tag])
+    return parsed
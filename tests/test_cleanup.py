@@ -0,0 +1,115 @@
+import shutil
+from pathlib import Path
+
+from PIL import Image
+
+from burgher import Gallery, GalleryApp
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "burgher" / "templates"
+
+
+def make_site(tmp_path: Path) -> Path:
+    album = tmp_path / "photos" / "Album"
+    album.mkdir(parents=True)
+    for name, color in (("a.jpg", "teal"), ("b.jpg", "olive")):
+        Image.new("RGB", (64, 48), color).save(album / name)
+    (tmp_path / "index.md").write_text("# Gallery\n")
+    return album
+
+
+def make_app(tmp_path: Path, **config) -> GalleryApp:
+    app = GalleryApp(
+        name="test",
+        template_dir=str(TEMPLATE_DIR),
+        output_path=tmp_path / "build",
+        context_db_path=tmp_path / "context.sqlite",
+        check_paths=[TEMPLATE_DIR],
+        **config,
+    )
+    app.register(
+        gallery=Gallery(
+            tmp_path / "photos",
+            output_file="index.html",
+            source_file=tmp_path / "index.md",
+        ),
+    )
+    return app
+
+
+def thumbnails(tmp_path: Path, name: str, build="build") -> list[Path]:
+    return sorted((tmp_path / build / "Album").glob(f"*/{name}.*"))
+
+
+def test_cleanup_after_build_without_cleanup(tmp_path):
+    album = make_site(tmp_path)
+    make_app(tmp_path).generate()
+    assert thumbnails(tmp_path, "b")
+
+    (album / "b.jpg").unlink()
+    make_app(tmp_path).generate()
+
+    app = make_app(tmp_path)
+    app.generate()
+    app.photo_cleanup(dry=False)
+
+    assert thumbnails(tmp_path, "b") == []
+    assert thumbnails(tmp_path, "a")
+
+
+def test_cleanup_without_generate(tmp_path):
+    album = make_site(tmp_path)
+    make_app(tmp_path).generate()
+
+    (album / "b.jpg").unlink()
+    make_app(tmp_path).generate()
+
+    make_app(tmp_path).photo_cleanup(dry=False)
+
+    assert thumbnails(tmp_path, "b") == []
+    assert thumbnails(tmp_path, "a")
+
+
+def test_cleanup_local_build(tmp_path):
+    album = make_site(tmp_path)
+    local = {"local_build": tmp_path / "local"}
+    make_app(tmp_path, **local).generate()
+    assert thumbnails(tmp_path, "b", "local")
+
+    (album / "b.jpg").unlink()
+    make_app(tmp_path, **local).generate()
+    make_app(tmp_path, **local).photo_cleanup(dry=False)
+
+    assert thumbnails(tmp_path, "b") == []
+    assert thumbnails(tmp_path, "b", "local") == []
+    assert thumbnails(tmp_path, "a", "local")
+
+
+def test_deleted_local_build_is_generated_again(tmp_path):
+    make_site(tmp_path)
+    local = {"local_build": tmp_path / "local"}
+    make_app(tmp_path, **local).generate()
+
+    shutil.rmtree(tmp_path / "local")
+    make_app(tmp_path, **local).generate()
+
+    assert (tmp_path / "local" / "index.html").exists()
+    assert (tmp_path / "local" / "Album" / "index.html").exists()
+    assert thumbnails(tmp_path, "a", "local")
+
+
+def test_cleanup_prunes_content_store(tmp_path):
+    album = make_site(tmp_path)
+    store = {"content_store_path": tmp_path / "store"}
+    make_app(tmp_path, **store).generate()
+    stored = sorted((tmp_path / "store").glob("*/*/*"))
+    assert stored
+
+    (album / "b.jpg").unlink()
+    app = make_app(tmp_path, **store)
+    app.generate()
+    app.photo_cleanup(dry=False)
+
+    kept = sorted((tmp_path / "store").glob("*/*/*"))
+    assert kept and len(kept) < len(stored)
+    assert all(p.samefile(t) for p, t in zip(kept, thumbnails(tmp_path, "a")))
+    assert len(list((tmp_path / "store").iterdir())) == 1
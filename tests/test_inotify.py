@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from burgher.inotify import Inotify
+
+
+@pytest.fixture
+def inotify():
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError, TypeError):
+        pytest.skip("inotify is not available")
+    yield inotify
+    inotify.close()
+
+
+def test_add_tree_again_after_overflow(tmp_path, inotify):
+    (tmp_path / "album").mkdir()
+    inotify.add_tree(tmp_path)
+
+    # what watch does after the kernel dropped events
+    (tmp_path / "album" / "new").mkdir()
+    inotify.add_tree(tmp_path)
+    assert sorted(inotify.watches.values()) == [
+        str(tmp_path),
+        str(tmp_path / "album"),
+        str(tmp_path / "album" / "new"),
+    ]
+    inotify.wait(0)
+
+    (tmp_path / "album" / "new" / "a.jpg").write_bytes(b"")
+    assert os.path.join(tmp_path, "album", "new", "a.jpg") in inotify.wait(1)
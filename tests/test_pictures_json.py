@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+from PIL import Image
+
+from burgher import Gallery, GalleryApp
+from burgher.hash_utils import DirectoryIndex
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "burgher" / "templates"
+
+
+def make_app(tmp_path: Path) -> GalleryApp:
+    app = GalleryApp(
+        name="test",
+        template_dir=str(TEMPLATE_DIR),
+        output_path=tmp_path / "build",
+        context_db_path=tmp_path / "context.sqlite",
+        check_paths=[TEMPLATE_DIR],
+        pictures_json="album",
+    )
+    app.register(
+        gallery=Gallery(
+            tmp_path / "photos",
+            output_file="index.html",
+            source_file=tmp_path / "index.md",
+        ),
+    )
+    return app
+
+
+def add_album(tmp_path: Path, name: str):
+    album = tmp_path / "photos" / name
+    album.mkdir(parents=True)
+    Image.new("RGB", (64, 48), "teal").save(album / "a.jpg")
+
+
+def shard_names(tmp_path: Path) -> list[str]:
+    index = json.loads((tmp_path / "build" / "pictures.json").read_text())
+    return [shard["name"] for shard in index["shards"]]
+
+
+def test_shards_follow_changes_of_the_tree(tmp_path):
+    (tmp_path / "index.md").write_text("# Gallery\n")
+    add_album(tmp_path, "One")
+    app = make_app(tmp_path)
+    app.generate()
+    assert shard_names(tmp_path) == ["One"]
+
+    # what watch does after a change
+    add_album(tmp_path, "Two")
+    old = app.directory_index
+    app.directory_index = DirectoryIndex()
+    app.apply_changes(old, app.directory_index)
+
+    assert shard_names(tmp_path) == ["One", "Two"]
+    assert (tmp_path / "build" / "_pictures" / "Two.json").exists()
@@ -0,0 +1,55 @@
+import pytest
+from PIL import Image
+
+from burgher.thumbnails import (
+    encoder_options,
+    generate_thumbnails,
+    thumbnail_dimensions,
+)
+from burgher.utils import parse_thumb_size
+
+SIZES = ("120x", "1920x1920", "3000x3000", "4000x3000")
+
+
+@pytest.mark.parametrize(
+    "size, orientation", [((12345, 3001), 6), ((3001, 12345), 1), ((800, 600), 1)]
+)
+def test_thumbnail_dimensions_match_output(tmp_path, size, orientation):
+    source = tmp_path / "source.jpg"
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    Image.new("RGB", size, "teal").save(source, exif=exif)
+
+    width, height = size
+    if orientation == 6:
+        width, height = height, width
+    predicted = thumbnail_dimensions(
+        {name: parse_thumb_size(name) for name in SIZES}, width, height, jpeg=True
+    )
+
+    outputs = {name: tmp_path / f"{name}.jpg" for name in SIZES}
+    generate_thumbnails(
+        source,
+        [(parse_thumb_size(name), [(path, {})]) for name, path in outputs.items()],
+    )
+
+    for name, path in outputs.items():
+        with Image.open(path) as thumbnail:
+            assert predicted[name] == list(thumbnail.size), name
+
+
+def test_encoder_options_of_extra_formats():
+    profile = {
+        "quality": 80,
+        "progressive": True,
+        "formats": ["webp", "avif"],
+        "jpeg": {"optimize": True},
+        "webp": {"quality": 60},
+    }
+    assert encoder_options(profile, "jpeg") == {
+        "quality": 80,
+        "progressive": True,
+        "optimize": True,
+    }
+    assert encoder_options(profile, "webp", extra_format=True) == {"quality": 60}
+    assert encoder_options(profile, "avif", extra_format=True) == {"quality": 80}
@@ -0,0 +1,27 @@
+import os
+
+from burgher.utils import NEW_FILE_MODE, StreamIfChanged, write_if_changed
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "page.html"
+    assert write_if_changed(path, b"one")
+    assert os.stat(path).st_mode & 0o777 == NEW_FILE_MODE
+
+    os.chmod(path, 0o600)
+    assert not write_if_changed(path, b"one")
+    assert write_if_changed(path, b"two")
+    assert path.read_bytes() == b"two"
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.listdir(tmp_path) == ["page.html"]
+
+
+def test_stream_if_changed(tmp_path):
+    path = tmp_path / "pictures.json"
+    for content, changed in ((b"[1]", True), (b"[1]", False), (b"[2]", True)):
+        with StreamIfChanged(path) as f:
+            f.write(content)
+        assert f.changed is changed
+        assert path.read_bytes() == content
+    assert os.stat(path).st_mode & 0o777 == NEW_FILE_MODE
+    assert os.listdir(tmp_path) == ["pictures.json"]